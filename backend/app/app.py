@@ -5,45 +5,269 @@ Handles video upload, processing, and verification results
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from datetime import datetime
-import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import queue
+import threading
+import time
 import uuid
-import base64
-import cv2
 import numpy as np
-from typing import Dict, Tuple
+from typing import Dict, List, Optional, Tuple
 import logging
 
-from app.services.liveness_detection import LivenessDetector, ChallengeType
-from app.services.deepfake_detection import DeepfakeDetector
+from app.services.liveness_detection import LivenessDetector, LivenessAnalysis, ChallengeType
+from app.services.deepfake_detection import DeepfakeDetector, DeepfakeAnalysis
+from app.services.face_preprocessing import FacePreprocessor, load_onnx_face_mesh, load_yunet
 from app.services.spoof_alerting import SpoofAlertingService, AlertType, AlertSeverity
 from app.utils.video_processor import VideoProcessor
+from app.utils.frame_decoder import (
+    decode_jpeg, decode_jpeg_batch, decode_data_url, jpeg_size, NVJPEG_AVAILABLE
+)
+from app.utils.session_store import Session, create_session_store
+from app.utils.frame_buffer import FrameRingBuffer
+from app.utils.timestamps import now_ns, ns_to_iso, precise_now_iso
+from app.utils.json_provider import OrjsonProvider, ORJSON_AVAILABLE
 from app.utils.config import Config
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Try to import Flask-Compress for gzip/brotli responses
+try:
+    from flask_compress import Compress
+    COMPRESS_AVAILABLE = True
+except ImportError:
+    COMPRESS_AVAILABLE = False
+
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app, resources={r"/api/*": {"origins": "*", "methods": ["GET", "POST", "OPTIONS"], "allow_headers": ["Content-Type"]}})
+if ORJSON_AVAILABLE:
+    app.json = OrjsonProvider(app)
+CORS(app, resources={r"/api/*": {"origins": "*", "methods": ["GET", "POST", "OPTIONS"], "allow_headers": ["Content-Type", "X-Session-Id", "X-Frame-Ts"]}})
 
 # Configuration
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 app.config['UPLOAD_FOLDER'] = Config.UPLOAD_FOLDER
 app.config['TEMP_FOLDER'] = Config.TEMP_FOLDER
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_LEVEL'] = 4
+
+if COMPRESS_AVAILABLE:
+    Compress(app)
 
 # Create folders if they don't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['TEMP_FOLDER'], exist_ok=True)
+Config.ensure_dirs()
 
 # Initialize services
+if Config.YUNET_MODEL_PATH and not load_yunet(Config.YUNET_MODEL_PATH):
+    logger.warning(f"Could not load YuNet model {Config.YUNET_MODEL_PATH}; using the Haar cascade")
+if Config.FACE_MESH_ONNX_PATH and not load_onnx_face_mesh(Config.FACE_MESH_ONNX_PATH):
+    logger.warning(f"Could not load ONNX FaceMesh {Config.FACE_MESH_ONNX_PATH}; using MediaPipe")
+face_preprocessor = FacePreprocessor()
 liveness_detector = LivenessDetector(confidence_threshold=0.7)
 deepfake_detector = DeepfakeDetector(history_size=30)
 spoof_alerter = SpoofAlertingService()
 
-# Active sessions
-active_sessions = {}
+# Liveness and deepfake analysis run side by side on a shared pool.
+# Detectors keep per-stream history, so each one is serialized by its own lock.
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+preprocess_lock = threading.Lock()
+liveness_lock = threading.Lock()
+deepfake_lock = threading.Lock()
+
+# Active sessions (in-memory, or shared through Redis when REDIS_URL is set)
+session_store = create_session_store(Config.REDIS_URL, ttl=Config.SESSION_TTL, maxsize=Config.MAX_SESSIONS)
+
+# With nvJPEG, frames are queued as JPEG bytes and decoded on the GPU in batches
+GPU_DECODE = Config.JPEG_DECODE_DEVICE == 'cuda' and NVJPEG_AVAILABLE
+if Config.JPEG_DECODE_DEVICE == 'cuda' and not NVJPEG_AVAILABLE:
+    logger.warning("JPEG_DECODE_DEVICE=cuda but torchvision/CUDA is not available; decoding on the CPU")
+
+# Frames waiting for analysis: (session_id, frame_id, frame or JPEG bytes)
+frame_queue = queue.Queue(maxsize=Config.ANALYSIS_QUEUE_SIZE)
+frame_ids = itertools.count(1)
+
+# Optional retention of decoded frames in per-session memory-mapped ring buffers
+frame_buffers: Dict[str, FrameRingBuffer] = {}
+frame_buffers_lock = threading.Lock()
+
+# Per-session count of queued frames; notified whenever a frame finishes
+pending_frames: Dict[str, int] = defaultdict(int)
+analysis_done = threading.Condition()
+
+
+def _run_locked(lock: threading.Lock, detector, frames: List[np.ndarray], pres=None) -> List[Dict]:
+    """Run a detector on a batch of frames while holding its lock"""
+    with lock:
+        return detector.process_batch(frames, pres)
+
+
+def analyze_frames(frames: List[np.ndarray]) -> List[Tuple[LivenessAnalysis, DeepfakeAnalysis]]:
+    """
+    Detect faces/landmarks once, then run liveness and deepfake
+    detection concurrently on a batch of frames
+    """
+    with preprocess_lock:
+        pres = face_preprocessor.process_batch(frames)
+    liveness_future = EXECUTOR.submit(_run_locked, liveness_lock, liveness_detector, frames, pres)
+    deepfake_future = EXECUTOR.submit(_run_locked, deepfake_lock, deepfake_detector, frames, pres)
+    return list(zip(liveness_future.result(), deepfake_future.result()))
+
+
+def _record_analysis(session_id: str, frame_id: int, liveness_result: LivenessAnalysis,
+                     deepfake_result: DeepfakeAnalysis, retained_index: Optional[int] = None):
+    """
+    Store one frame's analysis on its session and raise per-frame alerts.
+    retained_index is the frame's slot in the session's FrameRingBuffer, if kept.
+    """
+    session = session_store.get(session_id)
+    if session is None:
+        return
+    
+    # Running aggregates so completion doesn't rescan every frame
+    increments = {}
+    if liveness_result.face_detected:
+        increments["liveness_sum"] = liveness_result.liveness_score
+        increments["liveness_frames"] = 1
+    if deepfake_result.face_detected:
+        increments["deepfake_sum"] = deepfake_result.deepfake_score
+        increments["deepfake_frames"] = 1
+    
+    # Store analysis (timestamps are kept as ints and only formatted when read)
+    ts_ns = now_ns()
+    session_store.record_analysis(
+        session_id,
+        entry={
+            "frame_id": frame_id,
+            "liveness": liveness_result,
+            "deepfake": deepfake_result,
+            "ts_ns": ts_ns,
+            "retained_index": retained_index
+        },
+        fields={
+            "last_analysis": {
+                "frame_id": frame_id,
+                "ts_ns": ts_ns,
+                "liveness_score": liveness_result.liveness_score,
+                "deepfake_score": deepfake_result.deepfake_score,
+                "face_detected": liveness_result.face_detected
+            }
+        },
+        increments=increments
+    )
+    
+    # Check for alerts
+    if not liveness_result.face_detected:
+        spoof_alerter.create_alert(
+            alert_type=AlertType.FACE_NOT_DETECTED,
+            session_id=session_id,
+            severity=AlertSeverity.MEDIUM,
+            message="Face not detected in frame",
+            details={"frame_count": session.frame_count, "frame_id": frame_id},
+            user_id=session.user_id
+        )
+
+
+def _analysis_worker():
+    """Background thread that analyzes queued frames in small batches, in queue order"""
+    while True:
+        # Block for one frame, then take whatever else is already waiting
+        batch = [frame_queue.get()]
+        while len(batch) < Config.ANALYSIS_BATCH_SIZE:
+            try:
+                batch.append(frame_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        frames = [frame for _, _, frame in batch]
+        if GPU_DECODE:
+            frames = decode_jpeg_batch(frames, target_size=Config.ANALYSIS_INPUT_SIZE, device='cuda')
+        
+        # Frames that failed to decode are released without a result
+        decoded = [i for i, frame in enumerate(frames) if frame is not None]
+        
+        # Keep decoded frames for re-analysis, off the request threads
+        retained = [None] * len(batch)
+        if Config.FRAME_RETENTION:
+            for i in decoded:
+                try:
+                    retained[i] = _retain_frame(batch[i][0], frames[i])
+                except Exception as e:
+                    logger.error(f"Error retaining frame {batch[i][1]}: {str(e)}")
+        
+        results = [None] * len(batch)
+        try:
+            for i, result in zip(decoded, analyze_frames([frames[i] for i in decoded])):
+                results[i] = result
+        except Exception as e:
+            logger.error(f"Error analyzing batch of {len(batch)} frames: {str(e)}")
+        
+        for (session_id, frame_id, _), result, retained_index in zip(batch, results, retained):
+            try:
+                if result is not None:
+                    _record_analysis(session_id, frame_id, *result, retained_index=retained_index)
+            except Exception as e:
+                logger.error(f"Error recording frame {frame_id} of session {session_id}: {str(e)}")
+            finally:
+                _release_pending(session_id)
+                frame_queue.task_done()
+
+
+def _retain_frame(session_id: str, frame: np.ndarray) -> int:
+    """Copy a decoded frame into the session's ring buffer and return its index"""
+    with frame_buffers_lock:
+        buffer = frame_buffers.get(session_id)
+        if buffer is None:
+            buffer = frame_buffers[session_id] = FrameRingBuffer(
+                Config.FRAME_RETENTION, Config.ANALYSIS_INPUT_SIZE, Config.FRAME_BUFFER_DIR
+            )
+    return buffer.write(frame)
+
+
+def _release_frame_buffer(session_id: str):
+    """Unmap and delete a session's retained frames"""
+    with frame_buffers_lock:
+        buffer = frame_buffers.pop(session_id, None)
+    if buffer is not None:
+        buffer.close()
+
+
+def _release_pending(session_id: str):
+    """Mark one queued frame of a session as finished"""
+    with analysis_done:
+        pending_frames[session_id] -= 1
+        if pending_frames[session_id] <= 0:
+            del pending_frames[session_id]
+        analysis_done.notify_all()
+
+
+def wait_for_analysis(session_id: str, timeout: float) -> bool:
+    """Block until every queued frame of a session has been analyzed"""
+    with analysis_done:
+        return analysis_done.wait_for(lambda: pending_frames.get(session_id, 0) == 0, timeout=timeout)
+
+
+def _purge_sessions():
+    """Background thread that drops sessions idle for longer than SESSION_TTL"""
+    while True:
+        time.sleep(Config.SESSION_PURGE_INTERVAL)
+        try:
+            purged = session_store.purge_expired()
+            if purged:
+                logger.info(f"Purged {purged} expired sessions")
+            for session_id in [sid for sid in list(frame_buffers) if sid not in session_store]:
+                _release_frame_buffer(session_id)
+        except Exception as e:
+            logger.error(f"Error purging sessions: {str(e)}")
+
+
+# A single consumer: FaceMesh tracking, the landmark throttle and the detectors'
+# temporal histories need frames in upload order, which concurrent batches
+# racing for the detector locks would not guarantee
+threading.Thread(target=_analysis_worker, daemon=True).start()
+threading.Thread(target=_purge_sessions, daemon=True).start()
 
 
 @app.route('/health', methods=['GET'])
@@ -64,14 +288,11 @@ def start_verification_session():
         
         session_id = str(uuid.uuid4())
         
-        active_sessions[session_id] = {
-            "user_id": user_id,
-            "session_id": session_id,
-            "status": "active",
-            "created_at": datetime.now().isoformat(),
-            "video_frames": [],
-            "analysis_results": {}
-        }
+        session_store.create(Session(
+            user_id=user_id,
+            session_id=session_id,
+            created_at=precise_now_iso()
+        ))
         
         logger.info(f"Started verification session {session_id} for user {user_id}")
         
@@ -95,7 +316,7 @@ def send_liveness_challenge():
         session_id = data.get('session_id')
         challenge_type = data.get('challenge_type', 'head_turn')
         
-        if session_id not in active_sessions:
+        if session_id not in session_store:
             return jsonify({"error": "Invalid session_id"}), 400
         
         # Get challenge
@@ -106,11 +327,11 @@ def send_liveness_challenge():
         
         challenge_details = liveness_detector.generate_challenge(challenge)
         
-        active_sessions[session_id]["current_challenge"] = {
+        session_store.update(session_id, {"current_challenge": {
             "type": challenge_type,
             "instruction": challenge_details.get("instruction"),
             "timeout": challenge_details.get("timeout")
-        }
+        }})
         
         logger.info(f"Challenge {challenge_type} sent for session {session_id}")
         
@@ -131,58 +352,75 @@ def send_liveness_challenge():
 def upload_video_frame():
     """Upload a video frame for processing"""
     try:
-        data = request.json
-        session_id = data.get('session_id')
-        frame_data = data.get('frame')  # Base64 encoded
+        frame_ts = None
+        if request.mimetype == 'application/octet-stream':
+            # JPEG body read straight off the socket; metadata travels in headers
+            session_id = request.headers.get('X-Session-Id')
+            frame_ts = request.headers.get('X-Frame-Ts')
+            frame_bytes = request.stream.read(app.config['MAX_CONTENT_LENGTH'])
+        elif request.mimetype == 'multipart/form-data':
+            # Raw JPEG bytes - no base64/JSON overhead
+            session_id = request.form.get('session_id')
+            upload = request.files.get('frame')
+            frame_bytes = upload.read() if upload else None
+        else:
+            # Legacy clients send a base64 data URL inside JSON
+            data = request.json
+            session_id = data.get('session_id')
+            frame_data = data.get('frame')
+            frame_bytes = decode_data_url(frame_data) if frame_data else None
         
-        if session_id not in active_sessions:
+        if session_id not in session_store:
             return jsonify({"error": "Invalid session_id"}), 400
         
-        if not frame_data:
+        if not frame_bytes:
             return jsonify({"error": "frame data is required"}), 400
         
-        # Decode frame
-        frame_bytes = base64.b64decode(frame_data.split(',')[1] if ',' in frame_data else frame_data)
-        frame_array = np.frombuffer(frame_bytes, dtype=np.uint8)
-        frame = cv2.imdecode(frame_array, cv2.IMREAD_COLOR)
+        # Decode frame (GPU decoding happens later, in batches, on the analysis workers)
+        if GPU_DECODE:
+            frame = frame_bytes if jpeg_size(frame_bytes) else None
+        else:
+            frame = decode_jpeg(frame_bytes, target_size=Config.ANALYSIS_INPUT_SIZE)
         
         if frame is None:
             return jsonify({"error": "Failed to decode frame"}), 400
         
-        # Store frame
-        active_sessions[session_id]["video_frames"].append(frame)
+        # Count the frame; the decoded pixels are not kept past this request
+        frame_count = session_store.incr(session_id, "frame_count")
+        if frame_count is None:
+            # Session expired or was evicted since the membership check
+            return jsonify({"error": "Invalid session_id"}), 400
         
-        # Perform immediate analysis
-        liveness_result = liveness_detector.process_frame(frame)
-        deepfake_result = deepfake_detector.process_frame(frame)
+        frame_id = next(frame_ids)
         
-        # Store analysis
-        if "frame_analysis" not in active_sessions[session_id]:
-            active_sessions[session_id]["frame_analysis"] = []
+        # Only every Nth frame is analyzed (every frame by default)
+        queued = (frame_count - 1) % Config.ANALYSIS_STRIDE == 0
         
-        active_sessions[session_id]["frame_analysis"].append({
-            "liveness": liveness_result,
-            "deepfake": deepfake_result,
-            "timestamp": datetime.now().isoformat()
-        })
+        if queued:
+            # Queue for background analysis
+            with analysis_done:
+                pending_frames[session_id] += 1
+            try:
+                frame_queue.put((session_id, frame_id, frame), timeout=Config.ANALYSIS_QUEUE_TIMEOUT)
+            except queue.Full:
+                _release_pending(session_id)
+                # The client retries this frame, so it must not count twice
+                session_store.incr(session_id, "frame_count", -1)
+                return jsonify({"error": "Analysis queue is full, retry later"}), 503
         
-        # Check for alerts
-        if not liveness_result.get("face_detected"):
-            spoof_alerter.create_alert(
-                alert_type=AlertType.FACE_NOT_DETECTED,
-                session_id=session_id,
-                severity=AlertSeverity.MEDIUM,
-                message="Face not detected in frame",
-                details={"frame_count": len(active_sessions[session_id]["video_frames"])},
-                user_id=active_sessions[session_id]["user_id"]
-            )
+        # Report the most recent completed analysis so clients can poll scores
+        session = session_store.get(session_id)
+        last_analysis = (session.last_analysis if session else None) or {}
         
         return jsonify({
             "session_id": session_id,
+            "frame_id": frame_id,
+            "frame_ts": frame_ts,
             "frame_received": True,
-            "liveness_score": liveness_result.get("liveness_score", 0),
-            "deepfake_score": deepfake_result.get("deepfake_score", 0),
-            "face_detected": liveness_result.get("face_detected", False)
+            "queued": queued,
+            "liveness_score": last_analysis.get("liveness_score", 0),
+            "deepfake_score": last_analysis.get("deepfake_score", 0),
+            "face_detected": last_analysis.get("face_detected", False)
         }), 200
         
     except Exception as e:
@@ -197,44 +435,54 @@ def complete_verification():
         data = request.json
         session_id = data.get('session_id')
         
-        if session_id not in active_sessions:
+        if session_id not in session_store:
             return jsonify({"error": "Invalid session_id"}), 400
         
-        session = active_sessions[session_id]
+        # Let queued frames finish before aggregating; never score partial data
+        if not wait_for_analysis(session_id, Config.ANALYSIS_WAIT_TIMEOUT):
+            logger.warning(f"Timed out waiting for frame analysis of session {session_id}")
+            return jsonify({"error": "Frame analysis still in progress, retry later"}), 503
+        
+        session = session_store.get(session_id)
         
-        if not session.get("frame_analysis"):
+        if not session.frames_processed:
             return jsonify({"error": "No frames analyzed"}), 400
         
-        # Calculate aggregate scores
-        liveness_scores = [f["liveness"]["liveness_score"] for f in session["frame_analysis"] if f["liveness"].get("face_detected")]
-        deepfake_scores = [f["deepfake"]["deepfake_score"] for f in session["frame_analysis"] if f["deepfake"].get("face_detected")]
+        # Calculate aggregate scores from the running sums
+        liveness_frames = session.liveness_frames
+        deepfake_frames = session.deepfake_frames
         
-        avg_liveness = np.mean(liveness_scores) if liveness_scores else 0
-        avg_deepfake = np.mean(deepfake_scores) if deepfake_scores else 0
+        avg_liveness = session.liveness_sum / liveness_frames if liveness_frames else 0.0
+        avg_deepfake = session.deepfake_sum / deepfake_frames if deepfake_frames else 0.0
         
         # Aggregate analysis
         deepfake_analysis = {
-            "deepfake_score": float(avg_deepfake),
-            "face_detected": len([f for f in session["frame_analysis"] if f["deepfake"].get("face_detected")]) > 0,
+            "deepfake_score": avg_deepfake,
+            "face_detected": deepfake_frames > 0,
             "indicators": {}
         }
         
         liveness_analysis = {
-            "liveness_score": float(avg_liveness),
-            "face_detected": len([f for f in session["frame_analysis"] if f["liveness"].get("face_detected")]) > 0
+            "liveness_score": avg_liveness,
+            "face_detected": liveness_frames > 0
         }
         
         # Get verification result
         verification_result = spoof_alerter.evaluate_verification_result(
             session_id=session_id,
-            user_id=session["user_id"],
+            user_id=session.user_id,
             deepfake_analysis=deepfake_analysis,
             liveness_analysis=liveness_analysis
         )
         
         # Update session status
-        session["status"] = "completed"
-        session["verification_result"] = verification_result
+        session_store.update(session_id, {
+            "status": "completed",
+            "verification_result": verification_result
+        })
+        # Per-frame analyses and retained frames are no longer needed once the result is stored
+        session_store.discard_frames(session_id)
+        _release_frame_buffer(session_id)
         
         logger.info(f"Verification completed for session {session_id}: {verification_result['status']}")
         
@@ -251,17 +499,22 @@ def get_session_status():
     try:
         session_id = request.args.get('session_id')
         
-        if not session_id or session_id not in active_sessions:
+        session = session_store.get(session_id) if session_id else None
+        
+        if session is None:
             return jsonify({"error": "Invalid session_id"}), 400
         
-        session = active_sessions[session_id]
+        last_analysis = session.last_analysis
         
         return jsonify({
             "session_id": session_id,
-            "user_id": session["user_id"],
-            "status": session["status"],
-            "frames_processed": len(session.get("frame_analysis", [])),
-            "created_at": session["created_at"]
+            "user_id": session.user_id,
+            "status": session.status,
+            "frames_received": session.frame_count,
+            "frames_processed": session.frames_processed,
+            "frames_pending": pending_frames.get(session_id, 0),
+            "created_at": session.created_at,
+            "last_analysis_at": ns_to_iso(last_analysis["ts_ns"]) if last_analysis else None
         }), 200
         
     except Exception as e:
@@ -332,7 +585,3 @@ def not_found(error):
 def internal_error(error):
     return jsonify({"error": "Internal server error"}), 500
 
-
-if __name__ == '__main__':
-    from datetime import datetime
-    app.run(debug=False, host='0.0.0.0', port=5000)
@@ -5,29 +5,56 @@ and other indicators of AI-generated or manipulated content.
 """
 import cv2
 import numpy as np
-from typing import Dict, List, Tuple
-from dataclasses import dataclass
-from scipy import signal
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
 from scipy.fftpack import fft
+from scipy.fft import dctn
 import warnings
 
+from app.services.face_preprocessing import (
+    MEDIAPIPE_AVAILABLE, FaceDetectionCache, PreprocessedFrame, detect_faces_cascade,
+    get_face_mesh, locate_face, remove_duplicate_faces, to_gray
+)
+
 warnings.filterwarnings('ignore')
 
-# Try to import MediaPipe
+# Try to import Numba, fallback to plain Python if not available
 try:
-    import mediapipe as mp
-    try:
-        mp_face_mesh = mp.solutions.face_mesh
-        MEDIAPIPE_AVAILABLE = True
-    except (AttributeError, ImportError):
-        MEDIAPIPE_AVAILABLE = False
+    from numba import njit
+    NUMBA_AVAILABLE = True
 except ImportError:
-    MEDIAPIPE_AVAILABLE = False
+    NUMBA_AVAILABLE = False
 
-# Always load OpenCV cascade classifiers as fallback
-face_cascade = cv2.CascadeClassifier(
-    cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-)
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+# Eye aspect ratio below which an eye counts as closed
+EAR_THRESHOLD = 0.15
+
+
+@njit(cache=True)
+def _blink_stats(ear, threshold):
+    """
+    Single pass over an EAR history.
+    Returns (number of completed blinks, number of them with an abnormal
+    duration). Normal blinks last 100-400ms (~3-12 frames at 30fps).
+    """
+    blinks = 0
+    abnormal = 0
+    duration = 0
+    for i in range(ear.shape[0]):
+        if ear[i] < threshold:
+            duration += 1
+        elif duration > 0:
+            blinks += 1
+            if duration < 2 or duration > 15:
+                abnormal += 1
+            duration = 0
+    return blinks, abnormal
 
 
 @dataclass
@@ -38,6 +65,15 @@ class DeepfakeIndicator:
     details: Dict
 
 
+@dataclass(slots=True)
+class DeepfakeAnalysis:
+    """Deepfake analysis of a single frame"""
+    face_detected: bool
+    deepfake_score: float = 0.0
+    is_likely_deepfake: bool = False
+    indicators: Dict = field(default_factory=dict)
+
+
 class DeepfakeDetector:
     """
     Detects deepfakes and face manipulation through:
@@ -48,118 +84,141 @@ class DeepfakeDetector:
     - Face geometry inconsistencies
     """
     
+    # Gradient magnitude above which a pixel counts as an edge (between the
+    # 50/150 hysteresis thresholds Canny used here before)
+    EDGE_MAGNITUDE_THRESHOLD = 100
+    
+    # Face crops at least this large (shorter side, px) are halved before the
+    # per-pixel texture statistics
+    TEXTURE_DOWNSCALE_MIN_SIZE = 256
+    
+    # Mean landmark motion (px) below which the last texture analysis is reused
+    TEXTURE_REUSE_MOTION = 0.5
+    
+    # Frames are compared at this size for temporal analysis
+    TEMPORAL_THUMBNAIL_SIZE = (128, 128)
+    
+    # Columns of the face geometry history
+    GEOMETRY_FIELDS = ("face_height", "face_width", "mouth_width",
+                       "mouth_face_ratio", "width_height_ratio")
+    
+    # Eye aspect ratio landmark pairs, one row per eye (left, right):
+    # two vertical distances followed by the horizontal one
+    _EAR_I1 = np.array([[385, 387, 362], [160, 158, 33]], dtype=np.intp)
+    _EAR_I2 = np.array([[380, 373, 263], [144, 153, 133]], dtype=np.intp)
+    
+    # Face geometry landmark pairs: nose tip/chin, eye corners, mouth corners
+    _GEOM_IDX = np.array([1, 152, 33, 263, 61, 291], dtype=np.intp)
+    
     def __init__(self, history_size: int = 30):
         self.history_size = history_size
-        self.use_mediapipe = MEDIAPIPE_AVAILABLE
-        
-        if self.use_mediapipe:
-            try:
-                self.face_mesh = mp_face_mesh.FaceMesh(
-                    static_image_mode=False,
-                    max_num_faces=1,
-                    refine_landmarks=True,
-                    min_detection_confidence=0.5,
-                    min_tracking_confidence=0.5
-                )
-            except Exception:
-                self.use_mediapipe = False
-        
-        # History for temporal analysis
-        self.frame_history = []
-        self.blink_history = []
-        self.face_geometry_history = []
+        # Process-wide FaceMesh (None without MediaPipe)
+        self.face_mesh = get_face_mesh()
+        self.use_mediapipe = self.face_mesh is not None
+        self.cascade_cache = FaceDetectionCache()
+        
+        # History for temporal analysis: grayscale thumbnails and the mean
+        # difference between each consecutive pair
+        self.frame_history = deque(maxlen=history_size)
+        self.diff_history = deque(maxlen=history_size - 1)
+        self._diff_buf = np.empty(self.TEMPORAL_THUMBNAIL_SIZE[::-1], dtype=np.uint8)
+        # EAR history: a preallocated window of twice the history size, so the
+        # newest `history_size` values are always one contiguous slice
+        self._blink_buffer = np.empty(2 * history_size, dtype=np.float32)
+        self._blink_start = 0
+        self._blink_end = 0
+        # Face geometry history: one row of GEOMETRY_FIELDS per frame, written
+        # round-robin (only its spread is used, so row order doesn't matter)
+        self._geom = np.zeros((history_size, len(self.GEOMETRY_FIELDS)), dtype=np.float32)
+        self._geom_n = 0
         self.eye_gaze_history = []
+        
+        # Last texture analysis and the landmarks it was computed for
+        self._texture_cache = None
+        self._texture_landmarks = None
     
-    def detect_faces_cascade(self, frame: np.ndarray) -> List[Tuple]:
+    @property
+    def blink_history(self) -> List[float]:
+        """EAR values of the most recent frames, oldest first"""
+        return self._blink_window().tolist()
+    
+    def _blink_window(self) -> np.ndarray:
+        return self._blink_buffer[self._blink_start:self._blink_end]
+    
+    def _append_blink(self, ear: float):
+        if self._blink_end == len(self._blink_buffer):
+            # Slide the kept values back to the front of the buffer
+            keep = self._blink_end - self._blink_start
+            self._blink_buffer[:keep] = self._blink_buffer[self._blink_start:self._blink_end]
+            self._blink_start, self._blink_end = 0, keep
+        self._blink_buffer[self._blink_end] = ear
+        self._blink_end += 1
+        if self._blink_end - self._blink_start > self.history_size:
+            self._blink_start += 1
+    
+    def detect_faces_cascade(self, frame: np.ndarray, gray: Optional[np.ndarray] = None) -> List[Tuple]:
         """
         Detect faces using OpenCV cascade classifier with preprocessing.
         Returns list of face rectangles (x, y, w, h).
         """
-        try:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
-            # Preprocess for better detection
-            # Apply histogram equalization to improve contrast
-            gray = cv2.equalizeHist(gray)
-            
-            # Try multiple scale factors for more reliable detection
-            faces = []
-            for scale_factor in [1.05, 1.1, 1.2]:
-                detected = face_cascade.detectMultiScale(
-                    gray, 
-                    scaleFactor=scale_factor, 
-                    minNeighbors=4, 
-                    minSize=(20, 20),
-                    maxSize=(frame.shape[1]-10, frame.shape[0]-10)
-                )
-                faces.extend(detected)
-            
-            # Remove duplicates
-            if faces:
-                faces = self._remove_duplicate_faces(faces)
-            
-            return faces
-        except Exception:
-            return []
+        return detect_faces_cascade(frame, gray)
     
     def _remove_duplicate_faces(self, faces: List[Tuple]) -> List[Tuple]:
         """Remove duplicate/overlapping face detections."""
-        if len(faces) <= 1:
-            return list(faces)
-        
-        # Keep only the largest faces
-        faces = sorted(faces, key=lambda f: f[2] * f[3], reverse=True)
-        
-        unique_faces = [faces[0]]
-        for face in faces[1:]:
-            x, y, w, h = face
-            is_duplicate = False
-            for ux, uy, uw, uh in unique_faces:
-                overlap = (min(x+w, ux+uw) - max(x, ux)) * (min(y+h, uy+uh) - max(y, uy))
-                if overlap > (w * h * 0.3):
-                    is_duplicate = True
-                    break
-            if not is_duplicate:
-                unique_faces.append(face)
-        
-        return unique_faces[:1]  # Return only the top face
+        return remove_duplicate_faces(faces)
     
-    def analyze_micro_textures(self, frame: np.ndarray, face_region: Tuple) -> Dict:
+    def analyze_micro_textures(self, frame: np.ndarray, face_region: Tuple,
+                               gray_frame: Optional[np.ndarray] = None) -> Dict:
         """
         Analyze texture patterns that are artifacts of deepfakes
         (e.g., smooth transitions, blending artifacts at face boundary)
+        Pass the frame's grayscale as gray_frame to avoid converting the crop again.
         """
         try:
             if face_region is None:
                 # Analyze whole frame when face region not available
                 # Use center region as approximation
-                h, w = frame.shape[:2]
-                x, y = int(w * 0.1), int(h * 0.1)
-                w_region, h_region = int(w * 0.8), int(h * 0.8)
-                face_crop = frame[y:y+h_region, x:x+w_region]
+                frame_h, frame_w = frame.shape[:2]
+                x, y = int(frame_w * 0.1), int(frame_h * 0.1)
+                w, h = int(frame_w * 0.8), int(frame_h * 0.8)
             else:
                 x, y, w, h = face_region
-                face_crop = frame[y:y+h, x:x+w]
             
-            # Convert to grayscale for texture analysis
-            gray = cv2.cvtColor(face_crop, cv2.COLOR_BGR2GRAY)
+            # Grayscale face crop for texture analysis
+            if gray_frame is not None:
+                gray = gray_frame[y:y+h, x:x+w]
+            else:
+                gray = to_gray(frame[y:y+h, x:x+w])
+            # Converted once, shared by the smoothness and compression checks
+            gray_f32 = gray.astype(np.float32)
             
-            # Compute Laplacian for edge/texture detection
-            laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-            laplacian_variance = np.var(laplacian)
+            # Close-up faces carry far more pixels than the statistics below
+            # need, so they run at half resolution. The compression (JPEG
+            # block grid) and boundary checks always see the full crop.
+            small, small_f32 = gray, gray_f32
+            if min(gray.shape[:2]) >= self.TEXTURE_DOWNSCALE_MIN_SIZE:
+                small = cv2.resize(gray, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+                small_f32 = small.astype(np.float32)
             
-            # Compute local binary patterns (simplified)
-            edges = cv2.Canny(gray, 50, 150)
-            edge_density = np.sum(edges > 0) / edges.size
+            # Compute Laplacian for edge/texture detection (float32 is plenty
+            # for 8-bit input; meanStdDev reduces it in one pass)
+            laplacian = cv2.Laplacian(small, cv2.CV_32F)
+            laplacian_variance = cv2.meanStdDev(laplacian)[1][0, 0] ** 2
             
-            # Analyze texture smoothness using Gabor filters
-            smoothness = self._analyze_smoothness(gray)
+            # Edge density from a single Sobel pass (Canny's thinning and
+            # hysteresis don't matter for a pixel count)
+            gx, gy = cv2.spatialGradient(small)
+            magnitude = cv2.magnitude(gx.astype(np.float32), gy.astype(np.float32))
+            edge_density = np.count_nonzero(magnitude > self.EDGE_MAGNITUDE_THRESHOLD) / magnitude.size
+            
+            # Analyze texture smoothness from local variance
+            smoothness = self._analyze_smoothness(small_f32)
             
             # Boundary artifacts (common in face swaps)
-            boundary_artifacts = self._detect_boundary_artifacts(face_crop, face_region if face_region else (0, 0, face_crop.shape[1], face_crop.shape[0]))
+            boundary_artifacts = self._detect_boundary_artifacts(gray, face_region if face_region else (0, 0, gray.shape[1], gray.shape[0]))
             
             # Compression artifacts
-            compression_artifacts = self._detect_compression_artifacts(gray)
+            compression_artifacts = self._detect_compression_artifacts(gray_f32)
             
             return {
                 "laplacian_variance": float(laplacian_variance),
@@ -184,12 +243,14 @@ class DeepfakeDetector:
     
     def _analyze_smoothness(self, gray_face: np.ndarray) -> float:
         """Analyze if texture is unnaturally smooth (deepfake indicator)"""
-        # Apply median filter to enhance smooth regions
-        median = cv2.medianBlur(gray_face, 5)
+        # Local 5x5 variance from box-filtered moments (E[x^2] - E[x]^2)
+        g = gray_face.astype(np.float32, copy=False)
+        mean = cv2.boxFilter(g, -1, (5, 5))
+        mean_sq = cv2.boxFilter(g * g, -1, (5, 5))
+        local_var = np.maximum(mean_sq - mean * mean, 0)
         
-        # Calculate difference from original
-        diff = cv2.absdiff(gray_face, median)
-        smoothness = 1.0 - (np.mean(diff) / 255.0)
+        # Average local deviation, on the same 0-255 scale as pixel values
+        smoothness = 1.0 - (np.mean(np.sqrt(local_var)) / 255.0)
         
         return np.clip(smoothness, 0, 1)
     
@@ -211,45 +272,39 @@ class DeepfakeDetector:
             face_crop[:, -border_size:]   # Right
         ]
         
-        # Calculate variance in borders (high variance = artifacts)
+        # Calculate variance in borders (high variance = artifacts); meanStdDev
+        # reads the strided strips in place instead of copying them to float64
         border_variances = []
         for border in borders:
             if border.size > 0:
                 gray_border = cv2.cvtColor(border, cv2.COLOR_BGR2GRAY) if len(border.shape) == 3 else border
-                border_variances.append(np.var(gray_border))
+                border_variances.append(cv2.meanStdDev(gray_border)[1][0, 0] ** 2)
         
         artifact_score = np.mean(border_variances) / 100.0 if border_variances else 0.0
         return np.clip(artifact_score, 0, 1)
     
     def _detect_compression_artifacts(self, gray_face: np.ndarray) -> float:
         """Detect JPEG and codec compression artifacts"""
-        # Apply DCT and analyze frequency patterns
-        dct = cv2.dct(np.float32(gray_face) / 255.0)
+        # Only whole 8x8 blocks are analyzed (JPEG's block grid)
+        h8 = gray_face.shape[0] - gray_face.shape[0] % 8
+        w8 = gray_face.shape[1] - gray_face.shape[1] % 8
+        if h8 < 16 or w8 < 16:
+            return 0.0
         
-        # Compression creates artifacts at specific frequencies
-        # High energy at block boundaries indicates compression
-        block_artifacts = 0.0
+        # Split into a (rows, cols, 8, 8) grid of blocks and DCT each block,
+        # the same transform the JPEG encoder applied. The score below is a
+        # ratio of coefficient magnitudes, so pixels stay on the 0-255 scale.
+        blocks = gray_face[:h8, :w8].astype(np.float32, copy=False).reshape(h8 // 8, 8, w8 // 8, 8).transpose(0, 2, 1, 3)
+        coeffs = dctn(blocks, type=2, axes=(-2, -1), norm='ortho', workers=-1)
         
-        for i in range(0, gray_face.shape[0], 8):
-            for j in range(0, gray_face.shape[1], 8):
-                block_end_i = min(i + 8, dct.shape[0])
-                block_end_j = min(j + 8, dct.shape[1])
-                
-                block = dct[i:block_end_i, j:block_end_j]
-                
-                if block.size > 0:
-                    # Check edges of DCT block
-                    edges = np.concatenate([
-                        block[0, :],
-                        block[-1, :],
-                        block[:, 0],
-                        block[:, -1]
-                    ])
-                    
-                    block_artifacts += np.sum(np.abs(edges))
-        
-        artifact_score = block_artifacts / (gray_face.shape[0] * gray_face.shape[1])
-        return np.clip(artifact_score / 100.0, 0, 1)
+        # Blocking: DC steps between neighbouring blocks that the AC content
+        # inside the blocks doesn't account for (quantization removes it)
+        dc = coeffs[..., 0, 0]
+        dc_step = (np.abs(np.diff(dc, axis=0)).mean() + np.abs(np.diff(dc, axis=1)).mean()) / 2.0
+        ac_energy = (np.abs(coeffs).sum(axis=(-2, -1)) - np.abs(dc)).mean()
+        
+        artifact_score = dc_step / (dc_step + ac_energy + 1e-4)
+        return np.clip(artifact_score, 0, 1)
     
     def _compute_texture_anomaly_score(self, laplacian_var: float, edge_density: float,
                                       smoothness: float, boundary_artifacts: float) -> float:
@@ -269,149 +324,86 @@ class DeepfakeDetector:
         Analyze blink rates and patterns.
         Deepfakes often have unnatural blink patterns.
         """
-        # Eye aspect ratio
-        LEFT_EYE = [362, 385, 387, 263, 373, 380]
-        RIGHT_EYE = [33, 160, 158, 133, 153, 144]
-        
-        def eye_aspect_ratio(eye_points):
-            A = np.linalg.norm(eye_points[1] - eye_points[5])
-            B = np.linalg.norm(eye_points[2] - eye_points[4])
-            C = np.linalg.norm(eye_points[0] - eye_points[3])
-            return (A + B) / (2.0 * C) if C > 0 else 0
-        
-        left_eye = landmarks[LEFT_EYE]
-        right_eye = landmarks[RIGHT_EYE]
-        
-        left_ear = eye_aspect_ratio(left_eye)
-        right_ear = eye_aspect_ratio(right_eye)
-        avg_ear = (left_ear + right_ear) / 2.0
+        # Eye aspect ratio of both eyes from one batched norm
+        d = np.linalg.norm(landmarks[self._EAR_I1] - landmarks[self._EAR_I2], axis=-1)
+        vertical = d[:, 0] + d[:, 1]
+        horizontal = 2.0 * d[:, 2]
+        ear = np.divide(vertical, horizontal, out=np.zeros(2), where=horizontal > 0)
+        avg_ear = (ear[0] + ear[1]) / 2.0
         
-        self.blink_history.append(avg_ear)
-        
-        # Keep history limited
-        if len(self.blink_history) > self.history_size:
-            self.blink_history.pop(0)
+        self._append_blink(avg_ear)
+        blink_rate, blink_duration_anomaly = self._blink_rate_and_duration_anomaly()
         
         analysis = {
             "current_ear": float(avg_ear),
-            "blink_rate": self._calculate_blink_rate(),
+            "blink_rate": blink_rate,
             "blink_pattern_anomaly": self._detect_blink_pattern_anomaly(),
-            "blink_duration_anomaly": self._detect_blink_duration_anomaly()
+            "blink_duration_anomaly": blink_duration_anomaly
         }
         
         return analysis
     
-    def _calculate_blink_rate(self) -> float:
-        """Calculate blinks per minute from history"""
-        if len(self.blink_history) < 10:
-            return 0.0
-        
-        # Detect blinks (transitions below threshold)
-        EAR_THRESHOLD = 0.15
-        blinks = 0
-        was_closed = False
+    def _blink_rate_and_duration_anomaly(self) -> Tuple[float, float]:
+        """
+        Blinks per minute and the share of blinks with unnatural durations,
+        both taken from one pass over the history
+        """
+        ear = self._blink_window()
+        if len(ear) < 10:
+            return 0.0, 0.0
         
-        for ear in self.blink_history:
-            is_closed = ear < EAR_THRESHOLD
-            if was_closed and not is_closed:
-                blinks += 1
-            was_closed = is_closed
+        # A blink is a closed -> open transition
+        blinks, abnormal = _blink_stats(ear, EAR_THRESHOLD)
         
         # Normalize to blinks per minute (assuming ~30 fps)
-        blink_rate = (blinks / len(self.blink_history)) * 60 * 30 / 60
+        blink_rate = (blinks / len(ear)) * 60 * 30 / 60
+        duration_anomaly = abnormal / blinks if blinks else 0.0
         
-        return float(blink_rate)
+        return float(blink_rate), float(np.clip(duration_anomaly, 0, 1))
     
     def _detect_blink_pattern_anomaly(self) -> float:
         """Detect unnatural blink patterns"""
-        if len(self.blink_history) < 20:
+        history_array = self._blink_window()
+        if len(history_array) < 20:
             return 0.0
         
         # Deepfakes may have regular/periodic blink patterns
         # Calculate autocorrelation
-        history_array = np.array(self.blink_history)
         
         if np.std(history_array) < 1e-6:
             return 1.0  # Completely flat pattern is suspicious
         
-        correlation = signal.correlate(history_array, history_array, mode='full')
-        correlation = correlation[len(correlation)//2:]
-        correlation = correlation / correlation[0]
+        # Only lags 10-49 matter, so compute just those instead of the full
+        # 2N-1 correlation (mean removed so the EAR offset doesn't dominate)
+        x = history_array - history_array.mean()
+        lags = range(10, min(50, len(x)))
+        correlation = np.array([np.dot(x[:-lag], x[lag:]) for lag in lags]) / np.dot(x, x)
         
         # Check for periodicity (peaks at regular intervals)
-        periodicity_score = np.max(correlation[10:min(50, len(correlation))])
+        periodicity_score = np.max(correlation)
         
         # High periodicity is anomalous
         return float(np.clip(periodicity_score - 0.5, 0, 1))
     
-    def _detect_blink_duration_anomaly(self) -> float:
-        """Detect unnatural blink durations"""
-        if len(self.blink_history) < 10:
-            return 0.0
-        
-        EAR_THRESHOLD = 0.15
-        blink_durations = []
-        in_blink = False
-        duration = 0
-        
-        for ear in self.blink_history:
-            is_closed = ear < EAR_THRESHOLD
-            
-            if is_closed:
-                if not in_blink:
-                    in_blink = True
-                    duration = 1
-                else:
-                    duration += 1
-            else:
-                if in_blink:
-                    blink_durations.append(duration)
-                    in_blink = False
-                    duration = 0
-        
-        if not blink_durations:
-            return 0.0
-        
-        # Normal blink duration is 100-400ms (~3-12 frames at 30fps)
-        durations = np.array(blink_durations)
-        abnormal_count = np.sum((durations < 2) | (durations > 15))
-        
-        anomaly_score = abnormal_count / len(blink_durations) if blink_durations else 0.0
-        
-        return float(np.clip(anomaly_score, 0, 1))
-    
     def analyze_face_geometry(self, landmarks: np.ndarray) -> Dict:
         """
         Analyze facial geometry for consistency and natural proportions
         """
-        # Key facial measurements
-        nose_tip = landmarks[1]
-        chin = landmarks[152]
-        left_eye = landmarks[33]
-        right_eye = landmarks[263]
-        left_mouth = landmarks[61]
-        right_mouth = landmarks[291]
+        # Key facial measurements, gathered as (start, end) point pairs
+        points = landmarks[self._GEOM_IDX].reshape(3, 2, -1)
         
         # Distances
-        face_height = np.linalg.norm(chin - nose_tip)
-        face_width = np.linalg.norm(right_eye - left_eye)
-        mouth_width = np.linalg.norm(right_mouth - left_mouth)
+        face_height, face_width, mouth_width = np.linalg.norm(points[:, 1] - points[:, 0], axis=-1)
         
         # Ratios (should be relatively consistent)
         mouth_face_ratio = mouth_width / (face_height + 1e-6)
         width_height_ratio = face_width / (face_height + 1e-6)
         
         # Store history
-        self.face_geometry_history.append({
-            "face_height": face_height,
-            "face_width": face_width,
-            "mouth_width": mouth_width,
-            "mouth_face_ratio": mouth_face_ratio,
-            "width_height_ratio": width_height_ratio
-        })
-        
-        if len(self.face_geometry_history) > self.history_size:
-            self.face_geometry_history.pop(0)
+        self._geom[self._geom_n % self.history_size] = (
+            face_height, face_width, mouth_width, mouth_face_ratio, width_height_ratio
+        )
+        self._geom_n += 1
         
         # Analyze consistency
         consistency_score = self._analyze_geometry_consistency()
@@ -426,13 +418,12 @@ class DeepfakeDetector:
     
     def _analyze_geometry_consistency(self) -> float:
         """Analyze if facial geometry is consistent (low variance = suspicious)"""
-        if len(self.face_geometry_history) < 5:
+        valid = min(self._geom_n, self.history_size)
+        if valid < 5:
             return 0.0
         
-        ratios = np.array([h["width_height_ratio"] for h in self.face_geometry_history])
-        
         # Natural variation should have some variance
-        consistency = np.std(ratios)
+        consistency = self._geom[:valid, 4].std(dtype=np.float64)
         
         # Consistency score: high variance is good, low variance is suspicious
         # Normal std ~ 0.05-0.1, suspicious < 0.02
@@ -440,31 +431,28 @@ class DeepfakeDetector:
         
         return float(np.clip(anomaly, 0, 1))
     
-    def analyze_temporal_consistency(self, frame: np.ndarray) -> Dict:
+    def analyze_temporal_consistency(self, frame: np.ndarray, gray: Optional[np.ndarray] = None) -> Dict:
         """
         Analyze temporal consistency - e.g., flickering, unnatural transitions
+        History is kept as small grayscale thumbnails; pass the frame's grayscale
+        to skip converting it.
         """
-        self.frame_history.append(frame.copy())
+        if gray is None:
+            gray = to_gray(frame)
+        thumbnail = cv2.resize(gray, self.TEMPORAL_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
         
-        if len(self.frame_history) > self.history_size:
-            self.frame_history.pop(0)
+        # Only the newest pair is diffed; older differences are remembered
+        # (optical flow approximation)
+        if self.frame_history:
+            cv2.absdiff(self.frame_history[-1], thumbnail, dst=self._diff_buf)
+            self.diff_history.append(cv2.mean(self._diff_buf)[0])
+        self.frame_history.append(thumbnail)
         
         if len(self.frame_history) < 3:
             return {"temporal_anomaly": 0.0, "frame_differences": []}
         
-        # Calculate frame differences (optical flow approximation)
-        frame_diffs = []
-        
-        for i in range(1, len(self.frame_history)):
-            prev = cv2.cvtColor(self.frame_history[i-1], cv2.COLOR_BGR2GRAY)
-            curr = cv2.cvtColor(self.frame_history[i], cv2.COLOR_BGR2GRAY)
-            
-            diff = cv2.absdiff(prev, curr)
-            mean_diff = np.mean(diff)
-            frame_diffs.append(mean_diff)
-        
         # Detect unusual patterns
-        frame_diffs_array = np.array(frame_diffs)
+        frame_diffs_array = np.array(self.diff_history)
         
         # High variance in frame differences or sudden spikes indicate artifacts
         if len(frame_diffs_array) > 1:
@@ -475,71 +463,73 @@ class DeepfakeDetector:
         
         return {
             "temporal_anomaly": float(anomaly_score),
-            "mean_frame_difference": float(np.mean(frame_diffs)) if frame_diffs else 0.0,
+            "mean_frame_difference": float(np.mean(frame_diffs_array)) if len(frame_diffs_array) > 0 else 0.0,
             "frame_difference_variance": float(np.var(frame_diffs_array)) if len(frame_diffs_array) > 0 else 0.0
         }
     
-    def process_frame(self, frame: np.ndarray) -> Dict:
+    def _cached_micro_textures(self, frame: np.ndarray, face_region: Tuple,
+                               gray: np.ndarray, landmarks: np.ndarray) -> Dict:
+        """
+        Texture analysis, reused while the tracked face has not moved since it
+        was last computed. Motion is measured against those landmarks rather
+        than the previous frame, so slow drift still triggers a refresh.
+        """
+        cached = self._texture_landmarks
+        if (cached is not None and cached.shape == landmarks.shape
+                and np.abs(landmarks[:, :2] - cached[:, :2]).mean() < self.TEXTURE_REUSE_MOTION):
+            return dict(self._texture_cache)
+        
+        texture_analysis = self.analyze_micro_textures(frame, face_region, gray)
+        self._texture_cache = texture_analysis
+        self._texture_landmarks = landmarks
+        return dict(texture_analysis)
+    
+    def process_frame(self, frame: np.ndarray, pre: Optional[PreprocessedFrame] = None) -> DeepfakeAnalysis:
         """
         Process frame for deepfake indicators
+        When `pre` is given, its face detection and landmarks are reused.
         Returns comprehensive deepfake analysis
         """
         if frame is None or frame.size == 0:
-            return {
-                "face_detected": False,
-                "deepfake_score": 0.0,
-                "indicators": {}
-            }
+            return DeepfakeAnalysis(face_detected=False)
         
         try:
-            # Detect face using robust cascade classifier with preprocessing
-            faces = self.detect_faces_cascade(frame)
+            # Grayscale is computed once per frame and shared by every analysis
+            if pre is not None:
+                gray = pre.gray
+                faces, landmarks = pre.faces, pre.landmarks
+            else:
+                gray = to_gray(frame)
+                # FaceMesh when available, otherwise the cascade classifier
+                faces, landmarks = locate_face(frame, gray, self.face_mesh if self.use_mediapipe else None,
+                                               self.cascade_cache)
             face_detected = len(faces) > 0
             
             if not face_detected:
-                return {
-                    "face_detected": False,
-                    "deepfake_score": 0.0,
-                    "indicators": {}
-                }
+                return DeepfakeAnalysis(face_detected=False)
             
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            
-            # Try MediaPipe first, fall back to OpenCV
-            if self.use_mediapipe:
-                try:
-                    results = self.face_mesh.process(frame_rgb)
-                    
-                    if results.multi_face_landmarks:
-                        landmarks = np.array([
-                            [lm.x * frame.shape[1], lm.y * frame.shape[0], lm.z]
-                            for lm in results.multi_face_landmarks[0].landmark
-                        ])
-                    else:
-                        landmarks = None
-                except Exception:
-                    landmarks = None
-            else:
-                landmarks = None
+            if landmarks is not None:
+                # Normalized -> pixel coordinates; a float32 scale keeps the
+                # result float32 (a plain list would promote it to float64)
+                scale = np.array([frame.shape[1], frame.shape[0], 1], dtype=np.float32)
+                landmarks = np.asarray(landmarks, dtype=np.float32) * scale
             
             if landmarks is None:
                 # Face detected but no landmarks - use basic texture analysis only
-                texture_analysis = self.analyze_micro_textures(frame, None)
+                texture_analysis = self.analyze_micro_textures(frame, None, gray)
                 
                 # Without full facial landmarks, use conservative score
                 deepfake_score = texture_analysis.get("anomaly_score", 0) * 0.5 + 0.2  # Add baseline
                 
-                analysis = {
-                    "face_detected": True,
-                    "deepfake_score": float(np.clip(deepfake_score, 0, 1)),
-                    "is_likely_deepfake": deepfake_score > 0.6,
-                    "indicators": {
+                return DeepfakeAnalysis(
+                    face_detected=True,
+                    deepfake_score=float(np.clip(deepfake_score, 0, 1)),
+                    is_likely_deepfake=deepfake_score > 0.6,
+                    indicators={
                         "texture": texture_analysis,
                         "note": "Limited analysis - face detected but detailed landmarks unavailable"
                     }
-                }
-                
-                return analysis
+                )
             
             # Get face bounding box
             x_coords = landmarks[:, 0]
@@ -558,10 +548,10 @@ class DeepfakeDetector:
             face_region = (x_min, y_min, x_max - x_min, y_max - y_min)
             
             # Perform all analyses
-            texture_analysis = self.analyze_micro_textures(frame, face_region)
+            texture_analysis = self._cached_micro_textures(frame, face_region, gray, landmarks)
             blink_analysis = self.analyze_blink_patterns(landmarks)
             geometry_analysis = self.analyze_face_geometry(landmarks)
-            temporal_analysis = self.analyze_temporal_consistency(frame)
+            temporal_analysis = self.analyze_temporal_consistency(frame, gray)
             
             # Calculate composite deepfake score
             deepfake_score = (
@@ -571,63 +561,37 @@ class DeepfakeDetector:
                 temporal_analysis.get("temporal_anomaly", 0) * 0.2
             )
             
-            analysis = {
-                "face_detected": True,
-                "deepfake_score": float(np.clip(deepfake_score, 0, 1)),
-                "is_likely_deepfake": deepfake_score > 0.5,
-                "indicators": {
+            return DeepfakeAnalysis(
+                face_detected=True,
+                deepfake_score=float(np.clip(deepfake_score, 0, 1)),
+                is_likely_deepfake=deepfake_score > 0.5,
+                indicators={
                     "texture": texture_analysis,
                     "blink": blink_analysis,
                     "geometry": geometry_analysis,
                     "temporal": temporal_analysis
                 }
-            }
-            
-            return analysis
-        except Exception as e:
-            return {
-                "face_detected": False,
-                "deepfake_score": 0.0,
-                "indicators": {"error": str(e)}
-            }
-            
-            # Perform all analyses
-            texture_analysis = self.analyze_micro_textures(frame, face_region)
-            blink_analysis = self.analyze_blink_patterns(landmarks)
-            geometry_analysis = self.analyze_face_geometry(landmarks)
-            temporal_analysis = self.analyze_temporal_consistency(frame)
-            
-            # Calculate composite deepfake score
-            deepfake_score = (
-                texture_analysis.get("anomaly_score", 0) * 0.35 +
-                blink_analysis.get("blink_pattern_anomaly", 0) * 0.25 +
-                geometry_analysis.get("geometry_consistency_score", 0) * 0.2 +
-                temporal_analysis.get("temporal_anomaly", 0) * 0.2
             )
-            
-            analysis = {
-                "face_detected": True,
-                "deepfake_score": float(np.clip(deepfake_score, 0, 1)),
-                "is_likely_deepfake": deepfake_score > 0.5,
-                "indicators": {
-                    "texture": texture_analysis,
-                    "blink": blink_analysis,
-                    "geometry": geometry_analysis,
-                    "temporal": temporal_analysis
-                }
-            }
-            
-            return analysis
         except Exception as e:
-            return {
-                "face_detected": False,
-                "deepfake_score": 0.0,
-                "indicators": {"error": str(e)}
-            }
+            return DeepfakeAnalysis(face_detected=False, indicators={"error": str(e)})
+    
+    def process_batch(self, frames: List[np.ndarray],
+                      pres: Optional[List[PreprocessedFrame]] = None) -> List[DeepfakeAnalysis]:
+        """
+        Process several consecutive frames in one call.
+        Frames are analyzed in order so temporal history stays consistent.
+        """
+        if pres is None:
+            return [self.process_frame(frame) for frame in frames]
+        return [self.process_frame(frame, pre) for frame, pre in zip(frames, pres)]
     
     def reset(self):
         """Reset detector state"""
-        self.frame_history = []
-        self.blink_history = []
-        self.face_geometry_history = []
+        self.cascade_cache.reset()
+        self.frame_history.clear()
+        self.diff_history.clear()
+        self._blink_start = self._blink_end = 0
+        self._geom_n = 0
         self.eye_gaze_history = []
+        self._texture_cache = None
+        self._texture_landmarks = None
@@ -0,0 +1,622 @@
+"""
+Face Preprocessing Service
+Runs face detection and landmark extraction once per frame so the
+liveness and deepfake detectors can share the results.
+"""
+import atexit
+import functools
+import queue
+import threading
+import cv2
+import numpy as np
+from typing import List, Optional, Tuple
+from dataclasses import dataclass
+
+# Try to import MediaPipe, fallback to OpenCV if not available
+try:
+    import mediapipe as mp
+    try:
+        mp_face_mesh = mp.solutions.face_mesh
+        MEDIAPIPE_AVAILABLE = True
+    except (AttributeError, ImportError):
+        MEDIAPIPE_AVAILABLE = False
+except ImportError:
+    MEDIAPIPE_AVAILABLE = False
+
+# Try to import ONNX Runtime, fallback to MediaPipe if not available
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+# Always load OpenCV cascade classifiers as fallback
+face_cascade = cv2.CascadeClassifier(
+    cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+)
+
+# Optional YuNet CNN face detector (see load_yunet), used instead of the cascade
+_YUNET = None
+_YUNET_LOCK = threading.Lock()
+_YUNET_INPUT_SIZE = None
+
+# Optional ONNX FaceMesh landmark model (see load_onnx_face_mesh), used instead of MediaPipe
+_ONNX_FACE_MESH = None
+
+# Longest side of the image handed to FaceMesh; its models run at 192-256 px
+# internally, so larger inputs only cost conversion time
+MESH_INPUT_SIZE = 256
+
+# Longest side of the image face detection runs on; detection cost scales
+# with pixel count, and KYC faces fill a good part of the frame
+DETECTION_MAX_SIZE = 480
+
+# Histogram equalization only runs on frames outside this brightness range
+# or below this contrast; well-exposed frames gain little from it
+EQUALIZE_MEAN_RANGE = (80, 200)
+EQUALIZE_MIN_STDDEV = 40
+
+
+def to_gray(frame: np.ndarray) -> np.ndarray:
+    """
+    Grayscale view of a frame. Single-channel frames (e.g. the Y plane of a
+    YUV camera buffer) are used as they are, without any conversion.
+    """
+    if frame.ndim == 2:
+        return frame
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+
+@dataclass
+class PreprocessedFrame:
+    """Per-frame face data shared by the detectors"""
+    faces: List[Tuple]  # Face rectangles (x, y, w, h)
+    landmarks: Optional[np.ndarray]  # Normalized FaceMesh landmarks (x, y, z), None if unavailable
+    gray: np.ndarray  # Grayscale frame
+
+
+def create_face_mesh():
+    """New FaceMesh tracker with the settings used by every detector"""
+    return mp_face_mesh.FaceMesh(
+        static_image_mode=False,
+        max_num_faces=1,
+        refine_landmarks=True,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5
+    )
+
+
+class SharedFaceMesh:
+    """FaceMesh used by several detectors; MediaPipe graphs are not thread-safe"""
+
+    def __init__(self, face_mesh):
+        self._face_mesh = face_mesh
+        self._lock = threading.Lock()
+
+    def process(self, image: np.ndarray):
+        with self._lock:
+            return self._face_mesh.process(image)
+
+    def close(self):
+        with self._lock:
+            self._face_mesh.close()
+
+
+_FACE_MESH = None
+_FACE_MESH_LOCK = threading.Lock()
+
+
+def get_face_mesh() -> Optional[SharedFaceMesh]:
+    """
+    Process-wide FaceMesh, created on first use so detectors don't each
+    pay the model load. Returns None if MediaPipe is unavailable.
+    """
+    global _FACE_MESH
+    with _FACE_MESH_LOCK:
+        if _FACE_MESH is None and MEDIAPIPE_AVAILABLE:
+            try:
+                _FACE_MESH = SharedFaceMesh(create_face_mesh())
+                atexit.register(close_face_mesh)
+            except Exception:
+                return None
+        return _FACE_MESH
+
+
+def close_face_mesh():
+    """Release the shared FaceMesh (runs at exit)"""
+    global _FACE_MESH
+    with _FACE_MESH_LOCK:
+        if _FACE_MESH is not None:
+            _FACE_MESH.close()
+            _FACE_MESH = None
+
+
+def remove_duplicate_faces(faces) -> List[Tuple]:
+    """
+    Reduce overlapping face detections to the single top face.
+    Only one face is ever kept, so this is just the largest detection
+    (likely the most confident); no pairwise overlap test is needed.
+    Accepts a list of rectangles or detectMultiScale's (N, 4) array.
+    """
+    if len(faces) == 0:
+        return []
+    boxes = np.asarray(faces, dtype=np.int32).reshape(-1, 4)
+    x, y, w, h = boxes[np.argmax(boxes[:, 2] * boxes[:, 3])].tolist()
+    return [(x, y, w, h)]
+
+
+def load_yunet(model_path: str) -> bool:
+    """
+    Detect faces with OpenCV's YuNet CNN (ONNX model at model_path) instead
+    of the Haar cascade. Returns False if the model could not be loaded.
+    """
+    global _YUNET, _YUNET_INPUT_SIZE
+    try:
+        _YUNET = cv2.FaceDetectorYN.create(model_path, '', (320, 320), score_threshold=0.6)
+        _YUNET_INPUT_SIZE = (320, 320)
+        return True
+    except (cv2.error, AttributeError):
+        return False
+
+
+@dataclass(frozen=True)
+class DetectionGeometry:
+    """Face detection parameters that only depend on the frame size"""
+    scale: float
+    size: Tuple[int, int]       # (width, height) detection runs at
+    min_size: Tuple[int, int]   # cascade minSize at that size
+    max_size: Tuple[int, int]   # cascade maxSize at that size
+
+
+@functools.lru_cache(maxsize=16)
+def detection_geometry(height: int, width: int) -> DetectionGeometry:
+    """
+    Detection parameters for a frame size. Streams keep one resolution
+    (typically 640x480 or 1280x720), so these are worked out once per size.
+    """
+    scale = min(DETECTION_MAX_SIZE / max(height, width), 1.0)
+    small_width, small_height = round(width * scale), round(height * scale)
+    # Faces under 40px (full resolution) are useless for KYC, and skipping
+    # them drops the largest (most expensive) pyramid levels. The cascade
+    # can't go below its 24px training window anyway.
+    min_side = max(24, int(40 * scale))
+    return DetectionGeometry(
+        scale=scale,
+        size=(small_width, small_height),
+        min_size=(min_side, min_side),
+        max_size=(small_width - 10, small_height - 10)
+    )
+
+
+def downscale_for_detection(image: np.ndarray) -> Tuple[np.ndarray, DetectionGeometry]:
+    """Shrink an image to DETECTION_MAX_SIZE on its long side; returns (image, geometry)"""
+    geometry = detection_geometry(*image.shape[:2])
+    if geometry.scale == 1.0:
+        return image, geometry
+    return cv2.resize(image, geometry.size, interpolation=cv2.INTER_AREA), geometry
+
+
+def detect_faces_yunet(frame: np.ndarray) -> List[Tuple]:
+    """Detect faces with YuNet; returns the most prominent face rectangle (x, y, w, h)"""
+    global _YUNET_INPUT_SIZE
+    height, width = frame.shape[:2]
+    small, geometry = downscale_for_detection(frame)
+    if small.ndim == 2:
+        small = cv2.cvtColor(small, cv2.COLOR_GRAY2BGR)
+    with _YUNET_LOCK:
+        if geometry.size != _YUNET_INPUT_SIZE:
+            _YUNET.setInputSize(geometry.size)
+            _YUNET_INPUT_SIZE = geometry.size
+        _, faces = _YUNET.detect(small)
+
+    if faces is None:
+        return []
+
+    # Boxes can extend past the frame edges; clip them so crops stay valid
+    rects = []
+    for x, y, w, h in faces[:, :4] / geometry.scale:
+        x0, y0 = max(int(x), 0), max(int(y), 0)
+        x1, y1 = min(int(x + w), width), min(int(y + h), height)
+        if x1 > x0 and y1 > y0:
+            rects.append((x0, y0, x1 - x0, y1 - y0))
+    return remove_duplicate_faces(rects)
+
+
+def detect_faces_cascade(frame: np.ndarray, gray: Optional[np.ndarray] = None) -> List[Tuple]:
+    """
+    Detect faces using OpenCV cascade classifier with preprocessing
+    (or YuNet, once load_yunet has succeeded).
+    Returns list of face rectangles (x, y, w, h).
+    """
+    try:
+        if _YUNET is not None:
+            return detect_faces_yunet(frame)
+
+        if gray is None:
+            gray = to_gray(frame)
+        height, width = gray.shape[:2]
+
+        # Detect on a downscaled copy and map the result back
+        small, geometry = downscale_for_detection(gray)
+
+        # Preprocess for better detection
+        # Apply histogram equalization to dark, bright or flat frames
+        mean, stddev = cv2.meanStdDev(small)
+        if (not EQUALIZE_MEAN_RANGE[0] <= mean[0, 0] <= EQUALIZE_MEAN_RANGE[1]
+                or stddev[0, 0] < EQUALIZE_MIN_STDDEV):
+            small = cv2.equalizeHist(small)
+
+        # A single pyramid pass; detectMultiScale already groups overlapping hits
+        faces = face_cascade.detectMultiScale(
+            small,
+            scaleFactor=1.1,
+            minNeighbors=5,
+            minSize=geometry.min_size,
+            maxSize=geometry.max_size
+        )
+
+        # Keep the most prominent face
+        faces = remove_duplicate_faces(faces)
+        scale = geometry.scale
+        if scale == 1.0:
+            return faces
+        return [(int(x / scale), int(y / scale), min(int(w / scale), width), min(int(h / scale), height))
+                for x, y, w, h in faces]
+    except Exception:
+        return []
+
+
+class FaceDetectionCache:
+    """
+    Reuses the last cascade detection while the frame barely changes.
+    Frames are compared as 32x32 thumbnails against the one the cached faces
+    were detected on, so slow drift still triggers a new detection.
+    """
+
+    THUMBNAIL_SIZE = (32, 32)
+    MAX_MEAN_DIFF = 2.0
+
+    def __init__(self):
+        self._thumbnail = None
+        self._faces: List[Tuple] = []
+
+    def detect(self, frame: np.ndarray, gray: np.ndarray) -> List[Tuple]:
+        """Cascade face rectangles for a frame, from cache when it is unchanged"""
+        thumbnail = cv2.resize(gray, self.THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        if self._thumbnail is not None and cv2.absdiff(thumbnail, self._thumbnail).mean() < self.MAX_MEAN_DIFF:
+            return list(self._faces)
+
+        self._faces = detect_faces_cascade(frame, gray)
+        self._thumbnail = thumbnail
+        return list(self._faces)
+
+    def reset(self):
+        self._thumbnail = None
+        self._faces = []
+
+
+# Wire layout of one serialized NormalizedLandmark holding exactly x, y and z:
+# a length-delimited field-1 header, then three tagged little-endian floats
+_LANDMARK_WIRE_DTYPE = np.dtype([
+    ('tag', 'u1'), ('length', 'u1'),
+    ('x_tag', 'u1'), ('x', '<f4'),
+    ('y_tag', 'u1'), ('y', '<f4'),
+    ('z_tag', 'u1'), ('z', '<f4'),
+])
+_LANDMARK_WIRE_TAGS = (0x0A, 15, 0x0D, 0x15, 0x1D)
+
+
+def _landmarks_from_wire(landmark_list) -> Optional[np.ndarray]:
+    """
+    Decode a NormalizedLandmarkList straight from its serialized bytes, one
+    C-level serialization instead of three attribute reads per landmark.
+    Returns None when the message doesn't have the plain x/y/z layout.
+    """
+    data = landmark_list.SerializeToString()
+    if len(data) % _LANDMARK_WIRE_DTYPE.itemsize:
+        return None
+
+    records = np.frombuffer(data, dtype=_LANDMARK_WIRE_DTYPE)
+    for field, tag in zip(('tag', 'length', 'x_tag', 'y_tag', 'z_tag'), _LANDMARK_WIRE_TAGS):
+        if not np.all(records[field] == tag):
+            return None
+
+    landmarks = np.empty((len(records), 3), dtype=np.float32)
+    landmarks[:, 0] = records['x']
+    landmarks[:, 1] = records['y']
+    landmarks[:, 2] = records['z']
+    return landmarks
+
+
+def extract_landmarks(face_mesh, frame: np.ndarray) -> Optional[np.ndarray]:
+    """Run a FaceMesh on a BGR frame and return normalized landmarks, or None if no face was found"""
+    try:
+        # Landmarks are normalized, so they map back onto the full-size frame
+        scale = MESH_INPUT_SIZE / max(frame.shape[:2])
+        if scale < 1:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        # RGB is only ever produced here, for MediaPipe
+        results = face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB if frame.ndim == 2 else cv2.COLOR_BGR2RGB))
+
+        if results.multi_face_landmarks:
+            landmarks = _landmarks_from_wire(results.multi_face_landmarks[0])
+            if landmarks is not None:
+                return landmarks
+
+            # Filled one coordinate at a time: three flat float lists convert
+            # much faster than 478 per-landmark rows
+            lms = results.multi_face_landmarks[0].landmark
+            landmarks = np.empty((len(lms), 3), dtype=np.float32)
+            landmarks[:, 0] = [lm.x for lm in lms]
+            landmarks[:, 1] = [lm.y for lm in lms]
+            landmarks[:, 2] = [lm.z for lm in lms]
+            return landmarks
+    except Exception:
+        pass
+
+    return None
+
+
+def landmarks_to_rect(landmarks: np.ndarray, frame_shape: Tuple) -> Tuple[int, int, int, int]:
+    """Bounding rectangle (x, y, w, h) in pixels of normalized landmarks"""
+    height, width = frame_shape[:2]
+    x_min, y_min = landmarks[:, 0].min() * width, landmarks[:, 1].min() * height
+    x_max, y_max = landmarks[:, 0].max() * width, landmarks[:, 1].max() * height
+    return int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min)
+
+
+def faces_from_landmarks(landmarks: Optional[np.ndarray], frame_shape: Tuple) -> Tuple[List[Tuple], Optional[np.ndarray]]:
+    """Face rectangles and landmarks as returned by locate_face for a FaceMesh result"""
+    if landmarks is None:
+        return [], None
+    return [landmarks_to_rect(landmarks, frame_shape)], landmarks
+
+
+class OnnxFaceMesh:
+    """
+    MediaPipe's FaceMesh landmark model exported to ONNX, run with ONNX
+    Runtime on face crops from the face detector. Crops of several frames
+    go through the model as one batch when the export has a dynamic batch
+    dimension, and the output tensor is read directly, without protobufs.
+    """
+
+    INPUT_SIZE = 192
+    # Crops are squares this much larger than the detected face, as in MediaPipe
+    CROP_SCALE = 1.5
+    MIN_PRESENCE = 0.5
+
+    def __init__(self, model_path: str):
+        available = ort.get_available_providers()
+        providers = [p for p in ('CUDAExecutionProvider', 'CPUExecutionProvider') if p in available]
+        self.session = ort.InferenceSession(model_path, providers=providers)
+
+        model_input = self.session.get_inputs()[0]
+        self._input_name = model_input.name
+        self._channels_first = model_input.shape[1] == 3
+        self._batched = model_input.shape[0] != 1
+        self._lock = threading.Lock()
+
+    def _crop(self, frame: np.ndarray, face: Tuple) -> Tuple[np.ndarray, Tuple[float, float, float]]:
+        """RGB model input around a face rectangle, and its (scale, x0, y0) crop transform"""
+        x, y, w, h = face
+        side = self.CROP_SCALE * max(w, h)
+        x0, y0 = x + (w - side) / 2, y + (h - side) / 2
+        scale = self.INPUT_SIZE / side
+        # Crop and resize in one pass; parts outside the frame come out black
+        transform = np.array([[scale, 0, -x0 * scale], [0, scale, -y0 * scale]], dtype=np.float32)
+        crop = cv2.warpAffine(frame, transform, (self.INPUT_SIZE, self.INPUT_SIZE), flags=cv2.INTER_LINEAR)
+        crop = cv2.cvtColor(crop, cv2.COLOR_GRAY2RGB if crop.ndim == 2 else cv2.COLOR_BGR2RGB)
+        return crop, (scale, x0, y0)
+
+    def landmarks(self, frames: List[np.ndarray], faces: List[List[Tuple]]) -> List[Optional[np.ndarray]]:
+        """Normalized landmarks for each frame's first face rectangle, or None where there is no face"""
+        results: List[Optional[np.ndarray]] = [None] * len(frames)
+        jobs = [i for i, frame_faces in enumerate(faces) if frame_faces]
+        if not jobs:
+            return results
+
+        crops, transforms = zip(*(self._crop(frames[i], faces[i][0]) for i in jobs))
+        batch = np.stack(crops).astype(np.float32)
+        batch *= 1.0 / 255.0
+        if self._channels_first:
+            batch = batch.transpose(0, 3, 1, 2)
+
+        with self._lock:
+            if self._batched:
+                runs = [self.session.run(None, {self._input_name: batch})]
+            else:
+                runs = [self.session.run(None, {self._input_name: batch[k:k + 1]}) for k in range(len(jobs))]
+        outputs = [np.concatenate(tensors) for tensors in zip(*runs)]
+
+        # Landmarks are the (x, y, z) tensor; the face presence logit is the single value per crop
+        n = len(jobs)
+        points = next(o for o in outputs if o.size // n >= 3 * 468).reshape(n, -1, 3)
+        logits = next((o for o in outputs if o.size == n), None)
+        presence = 1.0 / (1.0 + np.exp(-logits.reshape(n))) if logits is not None else np.ones(n)
+
+        for k, i in enumerate(jobs):
+            if presence[k] < self.MIN_PRESENCE:
+                continue
+            scale, x0, y0 = transforms[k]
+            height, width = frames[i].shape[:2]
+            # Crop pixels -> frame pixels -> normalized, like MediaPipe's output
+            landmarks = points[k].astype(np.float32) / scale
+            landmarks[:, 0] = (landmarks[:, 0] + x0) / width
+            landmarks[:, 1] = (landmarks[:, 1] + y0) / height
+            landmarks[:, 2] /= width
+            results[i] = landmarks
+        return results
+
+
+def load_onnx_face_mesh(model_path: str) -> bool:
+    """
+    Extract landmarks with an ONNX export of the FaceMesh landmark model
+    instead of MediaPipe. Returns False if ONNX Runtime is missing or the
+    model could not be loaded.
+    """
+    global _ONNX_FACE_MESH
+    if not ONNXRUNTIME_AVAILABLE:
+        return False
+    try:
+        _ONNX_FACE_MESH = OnnxFaceMesh(model_path)
+        return True
+    except Exception:
+        return False
+
+
+def locate_face(frame: np.ndarray, gray: np.ndarray, face_mesh=None,
+                cascade_cache: Optional[FaceDetectionCache] = None) -> Tuple[List[Tuple], Optional[np.ndarray]]:
+    """
+    Find the face rectangle and landmarks in a frame.
+    With a FaceMesh, its built-in face detector decides whether a face is
+    present and the Haar cascade is skipped; without one, the cascade is
+    used (through cascade_cache when given) and landmarks only come from
+    the ONNX FaceMesh, if one is loaded.
+    """
+    if face_mesh is None:
+        if cascade_cache is not None:
+            faces = cascade_cache.detect(frame, gray)
+        else:
+            faces = detect_faces_cascade(frame, gray)
+        if _ONNX_FACE_MESH is not None and faces:
+            landmarks = _ONNX_FACE_MESH.landmarks([frame], [faces])[0]
+            if landmarks is not None:
+                return faces_from_landmarks(landmarks, frame.shape)
+        return faces, None
+
+    return faces_from_landmarks(extract_landmarks(face_mesh, frame), frame.shape)
+
+
+class LandmarkThrottle:
+    """
+    Decides which frames of a stream actually go through FaceMesh.
+    FaceMesh runs on every INTERVAL-th frame, or sooner when the frame moved
+    away from the last one it ran on (32x32 thumbnail comparison, as in
+    FaceDetectionCache); frames in between reuse the latest landmarks.
+    """
+
+    INTERVAL = 2
+    THUMBNAIL_SIZE = (32, 32)
+    MAX_MEAN_DIFF = 2.0
+
+    def __init__(self):
+        self._thumbnail = None
+        self._skipped = 0
+        self.landmarks: Optional[np.ndarray] = None
+
+    def should_run(self, frame: np.ndarray) -> bool:
+        """Whether FaceMesh has to run on this frame; frames must be passed in stream order"""
+        thumbnail = cv2.resize(frame, self.THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        if (self._thumbnail is None or self._skipped + 1 >= self.INTERVAL
+                or thumbnail.shape != self._thumbnail.shape
+                or cv2.absdiff(thumbnail, self._thumbnail).mean() >= self.MAX_MEAN_DIFF):
+            self._thumbnail = thumbnail
+            self._skipped = 0
+            return True
+        self._skipped += 1
+        return False
+
+    def reset(self):
+        self._thumbnail = None
+        self._skipped = 0
+        self.landmarks = None
+
+
+class LandmarkWorker:
+    """
+    Runs a FaceMesh on a dedicated thread so landmark inference overlaps
+    with the caller's own per-frame work.
+    Results come back in submission order, which keeps the tracker fed in
+    stream order; every submit() must be matched by one result().
+    """
+
+    def __init__(self, face_mesh):
+        self.face_mesh = face_mesh
+        self._frames = queue.Queue(maxsize=1)
+        self._results = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            frame = self._frames.get()
+            self._results.put(extract_landmarks(self.face_mesh, frame))
+
+    def submit(self, frame: np.ndarray):
+        """Queue a frame for landmark extraction (blocks while one is already waiting)"""
+        self._frames.put(frame)
+
+    def result(self) -> Optional[np.ndarray]:
+        """Landmarks of the oldest submitted frame still outstanding"""
+        return self._results.get()
+
+
+class FacePreprocessor:
+    """
+    Detects the face and its landmarks once per frame.
+    Keeps its own FaceMesh tracker, so frames must be fed in stream order.
+    FaceMesh itself only runs on the frames landmark_throttle picks.
+    """
+
+    def __init__(self):
+        self.use_mediapipe = MEDIAPIPE_AVAILABLE
+        self.cascade_cache = FaceDetectionCache()
+
+        if self.use_mediapipe:
+            try:
+                self.face_mesh = create_face_mesh()
+                self.landmark_worker = LandmarkWorker(self.face_mesh)
+                self.landmark_throttle = LandmarkThrottle()
+            except Exception:
+                self.use_mediapipe = False
+
+    def process_frame(self, frame: np.ndarray) -> PreprocessedFrame:
+        """Detect faces and landmarks in a single BGR (or single-channel luma) frame"""
+        return self.process_batch([frame])[0]
+
+    def process_batch(self, frames: List[np.ndarray]) -> List[PreprocessedFrame]:
+        """
+        Preprocess several consecutive frames in order.
+        With the ONNX FaceMesh, landmarks of the whole batch come from one
+        model run. With MediaPipe, the next frame is already queued on the
+        landmark thread while the current one is converted to grayscale.
+        """
+        if _ONNX_FACE_MESH is not None:
+            grays = [to_gray(frame) for frame in frames]
+            faces = [self.cascade_cache.detect(frame, gray) for frame, gray in zip(frames, grays)]
+            results = []
+            for frame, gray, frame_faces, landmarks in zip(frames, grays, faces,
+                                                           _ONNX_FACE_MESH.landmarks(frames, faces)):
+                if landmarks is not None:
+                    frame_faces, landmarks = faces_from_landmarks(landmarks, frame.shape)
+                results.append(PreprocessedFrame(faces=frame_faces, landmarks=landmarks, gray=gray))
+            return results
+
+        if not self.use_mediapipe:
+            results = []
+            for frame in frames:
+                gray = to_gray(frame)
+                faces, landmarks = locate_face(frame, gray, cascade_cache=self.cascade_cache)
+                results.append(PreprocessedFrame(faces=faces, landmarks=landmarks, gray=gray))
+            return results
+
+        results = []
+        submitted = [False] * len(frames)
+        if frames:
+            submitted[0] = self._submit(frames[0])
+        for i, frame in enumerate(frames):
+            gray = to_gray(frame)
+            if i + 1 < len(frames):
+                submitted[i + 1] = self._submit(frames[i + 1])
+            if submitted[i]:
+                self.landmark_throttle.landmarks = self.landmark_worker.result()
+            faces, landmarks = faces_from_landmarks(self.landmark_throttle.landmarks, frame.shape)
+            results.append(PreprocessedFrame(faces=faces, landmarks=landmarks, gray=gray))
+        return results
+
+    def _submit(self, frame: np.ndarray) -> bool:
+        """Queue a frame on the landmark thread if the throttle wants it; returns whether it did"""
+        if self.landmark_throttle.should_run(frame):
+            self.landmark_worker.submit(frame)
+            return True
+        return False
@@ -6,43 +6,65 @@ such as head movement and facial gestures.
 import cv2
 import numpy as np
 from typing import Dict, List, Tuple, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
+import math
 import time
 
-"""
-Liveness Detection Service
-Implements interactive liveness challenges requiring real-time user actions
-such as head movement and facial gestures.
-"""
-import cv2
-import numpy as np
-from typing import Dict, List, Tuple, Optional
-from dataclasses import dataclass
-from enum import Enum
-import time
+from app.services.face_preprocessing import (
+    MEDIAPIPE_AVAILABLE, FaceDetectionCache, PreprocessedFrame, detect_faces_cascade,
+    get_face_mesh, locate_face, remove_duplicate_faces, to_gray
+)
 
-# Try to import MediaPipe, fallback to OpenCV if not available
+# Try to import Numba, fallback to plain Python if not available
 try:
-    import mediapipe as mp
-    try:
-        mp_face_mesh = mp.solutions.face_mesh
-        mp_face_detection = mp.solutions.face_detection
-        MEDIAPIPE_AVAILABLE = True
-    except (AttributeError, ImportError):
-        MEDIAPIPE_AVAILABLE = False
+    from numba import njit
+    NUMBA_AVAILABLE = True
 except ImportError:
-    MEDIAPIPE_AVAILABLE = False
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
 
 # Always load OpenCV cascade classifiers as fallback
-face_cascade = cv2.CascadeClassifier(
-    cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-)
 eye_cascade = cv2.CascadeClassifier(
     cv2.data.haarcascades + 'haarcascade_eye.xml'
 )
 
 
+@njit(cache=True, fastmath=True)
+def _landmark_stats(landmarks, ear_i1, ear_i2, mouth_top, mouth_bottom):
+    """
+    Everything the landmark detectors need from one frame, in one pass.
+    Returns (average eye aspect ratio, mouth opening, x/y landmark centroid).
+    """
+    ear_sum = 0.0
+    norms = np.empty(3)
+    for eye in range(ear_i1.shape[0]):
+        for k in range(3):
+            a = ear_i1[eye, k]
+            b = ear_i2[eye, k]
+            sq = 0.0
+            for c in range(landmarks.shape[1]):
+                diff = landmarks[a, c] - landmarks[b, c]
+                sq += diff * diff
+            norms[k] = np.sqrt(sq)
+        horizontal = 2.0 * norms[2]
+        if horizontal > 0:
+            ear_sum += (norms[0] + norms[1]) / horizontal
+
+    sq = 0.0
+    for c in range(landmarks.shape[1]):
+        diff = landmarks[mouth_bottom, c] - landmarks[mouth_top, c]
+        sq += diff * diff
+
+    centroid = landmarks[:, :2].sum(axis=0) / landmarks.shape[0]
+    return ear_sum / ear_i1.shape[0], np.sqrt(sq), centroid
+
+
 class ChallengeType(Enum):
     """Types of liveness challenges"""
     HEAD_TURN = "head_turn"
@@ -52,6 +74,36 @@ class ChallengeType(Enum):
     NOD = "nod"
 
 
+# Instructions for each interactive challenge, built once instead of per request
+CHALLENGES = {
+    ChallengeType.HEAD_TURN: {
+        "instruction": "Please turn your head to the left and then to the right",
+        "expected_actions": ["horizontal_turn"],
+        "timeout": 8.0
+    },
+    ChallengeType.BLINK: {
+        "instruction": "Please blink your eyes",
+        "expected_actions": ["blink"],
+        "timeout": 5.0
+    },
+    ChallengeType.MOUTH_OPEN: {
+        "instruction": "Please open your mouth",
+        "expected_actions": ["mouth_open"],
+        "timeout": 5.0
+    },
+    ChallengeType.SMILE: {
+        "instruction": "Please smile",
+        "expected_actions": ["smile"],
+        "timeout": 5.0
+    },
+    ChallengeType.NOD: {
+        "instruction": "Please nod your head",
+        "expected_actions": ["vertical_nod"],
+        "timeout": 5.0
+    }
+}
+
+
 @dataclass
 class LivenessResult:
     """Result of liveness challenge"""
@@ -61,6 +113,15 @@ class LivenessResult:
     details: Dict
 
 
+@dataclass(slots=True)
+class LivenessAnalysis:
+    """Liveness analysis of a single frame"""
+    face_detected: bool
+    liveness_score: float = 0.0
+    is_likely_live: bool = False
+    detections: Dict = field(default_factory=dict)
+
+
 class LivenessDetector:
     """
     Detects liveness through interactive challenges and facial action units.
@@ -68,259 +129,212 @@ class LivenessDetector:
     Falls back to OpenCV if MediaPipe is unavailable.
     """
     
+    # Eye landmarks indices (MediaPipe face mesh); intp is NumPy's native
+    # index type, so fancy indexing with these needs no conversion
+    _LEFT_EYE = np.array([362, 385, 387, 263, 373, 380], dtype=np.intp)
+    _RIGHT_EYE = np.array([33, 160, 158, 133, 153, 144], dtype=np.intp)
+    
+    # Eye aspect ratio point pairs per eye (left, right): the two vertical
+    # eyelid distances, then the horizontal eye-corner distance
+    _EAR_I1 = np.stack([_LEFT_EYE, _RIGHT_EYE])[:, [1, 2, 0]]
+    _EAR_I2 = np.stack([_LEFT_EYE, _RIGHT_EYE])[:, [5, 4, 3]]
+    
+    # Mouth landmarks indices
+    _MOUTH_TOP = 13
+    _MOUTH_BOTTOM = 14
+    
+    # Frame differences are box-filtered down to this size before taking the median
+    MOTION_SAMPLE_SIZE = (64, 64)
+    
     def __init__(self, confidence_threshold: float = 0.7):
         self.confidence_threshold = confidence_threshold
-        self.use_mediapipe = MEDIAPIPE_AVAILABLE
+        # Process-wide FaceMesh (None without MediaPipe), so creating a
+        # detector per request doesn't load the model again
+        self.face_mesh = get_face_mesh()
+        self.use_mediapipe = self.face_mesh is not None
         
-        if self.use_mediapipe:
-            try:
-                self.face_mesh = mp_face_mesh.FaceMesh(
-                    static_image_mode=False,
-                    max_num_faces=1,
-                    refine_landmarks=True,
-                    min_detection_confidence=0.5,
-                    min_tracking_confidence=0.5
-                )
-                self.face_detection = mp_face_detection.FaceDetection(
-                    model_selection=1,
-                    min_detection_confidence=0.5
-                )
-            except Exception:
-                self.use_mediapipe = False
+        self.cascade_cache = FaceDetectionCache()
         
         # Challenge state tracking
         self.challenge_history = []
         self.prev_frame_landmarks = None
+        self._prev_xy = None
         self.blink_counter = 0
         self.eye_closed_frames = 0
         
-    def detect_blink(self, landmarks: Optional[np.ndarray] = None) -> Tuple[bool, float]:
+        # Motion fallback state: the previous grayscale frame and a scratch
+        # buffer for the difference, both reused across frames
+        self._prev_gray = None
+        self._diff_buf = None
+        self._motion_sample = None
+        
+    def _landmark_stats(self, landmarks: np.ndarray) -> Tuple[float, float, np.ndarray]:
+        """(average EAR, mouth opening, x/y centroid) of a landmark array"""
+        return _landmark_stats(landmarks, self._EAR_I1, self._EAR_I2, self._MOUTH_TOP, self._MOUTH_BOTTOM)
+    
+    def detect_blink(self, landmarks: Optional[np.ndarray] = None,
+                     stats: Optional[Tuple] = None) -> Tuple[bool, float]:
         """
         Detect eye blink using eye aspect ratio (EAR).
+        `stats` may carry the frame's precomputed _landmark_stats.
         Returns: (blink_detected, confidence)
         """
-        if landmarks is None or len(landmarks) == 0:
+        # Ensure we have enough landmarks
+        if landmarks is None or len(landmarks) < 400:
             return False, 0.0
         
-        # Eye landmarks indices (MediaPipe face mesh)
-        LEFT_EYE = [362, 385, 387, 263, 373, 380]
-        RIGHT_EYE = [33, 160, 158, 133, 153, 144]
+        avg_ear = (stats or self._landmark_stats(landmarks))[0]
         
-        try:
-            # Ensure we have enough landmarks
-            if len(landmarks) < 400:
-                return False, 0.0
-            
-            def eye_aspect_ratio(eye_points):
-                # Vertical distance between upper and lower eyelid
-                A = np.linalg.norm(eye_points[1] - eye_points[5])
-                B = np.linalg.norm(eye_points[2] - eye_points[4])
-                # Horizontal distance between eye corners
-                C = np.linalg.norm(eye_points[0] - eye_points[3])
-                return (A + B) / (2.0 * C) if C > 0 else 0
-            
-            left_eye_points = landmarks[LEFT_EYE]
-            right_eye_points = landmarks[RIGHT_EYE]
-            
-            left_ear = eye_aspect_ratio(left_eye_points)
-            right_ear = eye_aspect_ratio(right_eye_points)
-            
-            avg_ear = (left_ear + right_ear) / 2.0
-            
-            # Blink threshold
-            EAR_THRESHOLD = 0.15
-            
-            is_blink = avg_ear < EAR_THRESHOLD
-            confidence = 1.0 - avg_ear if is_blink else 0.0
-            
-            return is_blink, min(confidence, 1.0)
-        except:
-            return False, 0.0
+        # Blink threshold
+        EAR_THRESHOLD = 0.15
+        
+        is_blink = avg_ear < EAR_THRESHOLD
+        confidence = 1.0 - avg_ear if is_blink else 0.0
+        
+        return is_blink, min(confidence, 1.0)
     
-    def detect_head_movement(self, current_landmarks: Optional[np.ndarray] = None) -> Tuple[bool, float, Dict]:
+    def detect_head_movement(self, current_landmarks: Optional[np.ndarray] = None,
+                             stats: Optional[Tuple] = None) -> Tuple[bool, float, Dict]:
         """
-        Detect significant head movement by tracking facial landmarks position.
+        Detect significant head movement by tracking the on-screen (x/y)
+        centroid of the facial landmarks.
+        `stats` may carry the frame's precomputed _landmark_stats.
         Returns: (movement_detected, confidence, details)
         """
         if current_landmarks is None:
             return False, 0.0, {"reason": "no_landmarks"}
         
+        curr_xy = stats[2] if stats is not None else current_landmarks[:, :2].mean(axis=0)
+        
         if self.prev_frame_landmarks is None:
             self.prev_frame_landmarks = current_landmarks
+            self._prev_xy = curr_xy
             return False, 0.0, {"reason": "no_previous_frame"}
         
-        try:
-            # Calculate centroid displacement
-            prev_centroid = np.mean(self.prev_frame_landmarks, axis=0)
-            curr_centroid = np.mean(current_landmarks, axis=0)
-            
-            displacement = np.linalg.norm(curr_centroid - prev_centroid)
-            
-            # Movement threshold (adjust based on camera resolution)
-            MOVEMENT_THRESHOLD = 15.0
-            
-            movement_detected = displacement > MOVEMENT_THRESHOLD
-            confidence = min(displacement / MOVEMENT_THRESHOLD, 1.0) if movement_detected else 0.0
-            
-            self.prev_frame_landmarks = current_landmarks.copy()
-            
-            return movement_detected, confidence, {
-                "displacement": displacement,
-                "movement_types": ["head_movement"] if movement_detected else []
-            }
-        except:
+        # Calculate centroid displacement
+        if self._prev_xy is None:
+            self._prev_xy = np.asarray(self.prev_frame_landmarks)[:, :2].mean(axis=0)
+        if curr_xy.shape != self._prev_xy.shape:
             return False, 0.0, {"reason": "processing_error"}
+        dx = float(curr_xy[0] - self._prev_xy[0])
+        dy = float(curr_xy[1] - self._prev_xy[1])
+        disp_sq = dx * dx + dy * dy
+        
+        # Movement threshold (adjust based on camera resolution)
+        MOVEMENT_THRESHOLD = 15.0
+        
+        # Compared squared; the root is only needed for the reported values
+        movement_detected = disp_sq > MOVEMENT_THRESHOLD * MOVEMENT_THRESHOLD
+        displacement = math.sqrt(disp_sq)
+        confidence = min(displacement / MOVEMENT_THRESHOLD, 1.0) if movement_detected else 0.0
+        
+        # Landmark arrays are never modified in place, so no copy is needed
+        self.prev_frame_landmarks = current_landmarks
+        self._prev_xy = curr_xy
+        
+        return movement_detected, confidence, {
+            "displacement": displacement,
+            "movement_types": ["head_movement"] if movement_detected else []
+        }
     
-    def detect_mouth_open(self, landmarks: Optional[np.ndarray] = None) -> Tuple[bool, float]:
+    def detect_mouth_open(self, landmarks: Optional[np.ndarray] = None,
+                          stats: Optional[Tuple] = None) -> Tuple[bool, float]:
         """
         Detect mouth open gesture.
+        `stats` may carry the frame's precomputed _landmark_stats.
         Returns: (mouth_open, confidence)
         """
         if landmarks is None or len(landmarks) < 400:
             return False, 0.0
         
-        try:
-            # Mouth landmarks indices
-            MOUTH_TOP = 13
-            MOUTH_BOTTOM = 14
-            
-            mouth_top = landmarks[MOUTH_TOP]
-            mouth_bottom = landmarks[MOUTH_BOTTOM]
-            
-            mouth_distance = np.linalg.norm(mouth_bottom - mouth_top)
-            
-            # Mouth distance threshold
-            MOUTH_THRESHOLD = 20.0
-            
-            mouth_open = mouth_distance > MOUTH_THRESHOLD
-            confidence = min(mouth_distance / MOUTH_THRESHOLD, 1.0) if mouth_open else 0.0
-            
-            return mouth_open, min(confidence, 1.0)
-        except:
-            return False, 0.0
+        mouth_distance = (stats or self._landmark_stats(landmarks))[1]
+        
+        # Mouth distance threshold
+        MOUTH_THRESHOLD = 20.0
+        
+        mouth_open = mouth_distance > MOUTH_THRESHOLD
+        confidence = min(mouth_distance / MOUTH_THRESHOLD, 1.0) if mouth_open else 0.0
+        
+        return mouth_open, min(confidence, 1.0)
     
-    def detect_motion_in_frame(self, frame: np.ndarray) -> float:
+    def detect_motion_in_frame(self, frame: np.ndarray, gray: Optional[np.ndarray] = None) -> float:
         """
         Detect motion by comparing frame intensity changes.
         Returns motion confidence score (0-1).
         """
-        try:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
-            if self.prev_frame_landmarks is None:
-                self.prev_frame_landmarks = gray.copy()
-                return 0.2  # Some default liveness when no prev frame
-            
-            # Calculate frame difference
-            frame_diff = cv2.absdiff(gray, self.prev_frame_landmarks)
-            motion_magnitude = np.median(frame_diff)
-            
-            # Normalize motion to 0-1 range
-            motion_score = min(motion_magnitude / 50.0, 1.0)
-            
-            self.prev_frame_landmarks = gray.copy()
-            return motion_score
-        except:
-            return 0.1
+        if gray is None:
+            if frame is None or frame.size == 0:
+                return 0.1
+            gray = to_gray(frame)
+        
+        if (self._prev_gray is None or self._prev_gray.shape != gray.shape
+                or self._prev_gray.dtype != gray.dtype):
+            self._prev_gray = gray.copy()
+            self._diff_buf = np.empty_like(gray)
+            self._motion_sample = np.empty(self.MOTION_SAMPLE_SIZE[::-1], dtype=gray.dtype)
+            return 0.2  # Some default liveness when no prev frame
+        
+        # Calculate frame difference
+        frame_diff = cv2.absdiff(gray, self._prev_gray, dst=self._diff_buf)
+        # Median of the block means keeps the outlier resistance of a full
+        # median without sorting every pixel
+        sample = cv2.resize(frame_diff, self.MOTION_SAMPLE_SIZE, dst=self._motion_sample,
+                            interpolation=cv2.INTER_AREA)
+        motion_magnitude = np.median(sample)
+        
+        # Normalize motion to 0-1 range
+        motion_score = min(motion_magnitude / 50.0, 1.0)
+        
+        np.copyto(self._prev_gray, gray)
+        return motion_score
 
-    def detect_faces_cascade(self, frame: np.ndarray) -> List[Tuple]:
+    def detect_faces_cascade(self, frame: np.ndarray, gray: Optional[np.ndarray] = None) -> List[Tuple]:
         """
         Detect faces using OpenCV cascade classifier with preprocessing.
         Returns list of face rectangles (x, y, w, h).
         """
-        try:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
-            # Preprocess for better detection
-            # Apply histogram equalization to improve contrast
-            gray = cv2.equalizeHist(gray)
-            
-            # Try multiple scale factors for more reliable detection
-            faces = []
-            for scale_factor in [1.05, 1.1, 1.2]:
-                detected = face_cascade.detectMultiScale(
-                    gray, 
-                    scaleFactor=scale_factor, 
-                    minNeighbors=4, 
-                    minSize=(20, 20),
-                    maxSize=(frame.shape[1]-10, frame.shape[0]-10)
-                )
-                faces.extend(detected)
-            
-            # Remove duplicates - faces that overlap significantly
-            if faces:
-                faces = self._remove_duplicate_faces(faces)
-            
-            return faces
-        except Exception:
-            return []
+        return detect_faces_cascade(frame, gray)
     
     def _remove_duplicate_faces(self, faces: List[Tuple]) -> List[Tuple]:
         """Remove duplicate/overlapping face detections."""
-        if len(faces) <= 1:
-            return list(faces)
-        
-        # Keep only the largest faces (likely the most confident)
-        faces = sorted(faces, key=lambda f: f[2] * f[3], reverse=True)
-        
-        unique_faces = [faces[0]]
-        for face in faces[1:]:
-            x, y, w, h = face
-            is_duplicate = False
-            for ux, uy, uw, uh in unique_faces:
-                # Calculate overlap
-                overlap = (min(x+w, ux+uw) - max(x, ux)) * (min(y+h, uy+uh) - max(y, uy))
-                if overlap > (w * h * 0.3):  # 30% overlap threshold
-                    is_duplicate = True
-                    break
-            if not is_duplicate:
-                unique_faces.append(face)
-        
-        return unique_faces[:1]  # Return only the top face
-
-    def process_frame(self, frame: np.ndarray) -> Dict:
+        return remove_duplicate_faces(faces)
+    
+    def process_frame(self, frame: np.ndarray, pre: Optional[PreprocessedFrame] = None) -> LivenessAnalysis:
         """
         Process a single frame for liveness detection.
+        When `pre` is given, its face detection and landmarks are reused.
         Returns analysis results including detected actions.
         """
         if frame is None or frame.size == 0:
-            return {
-                "face_detected": False,
-                "liveness_score": 0.0,
-                "detections": {}
-            }
+            return LivenessAnalysis(face_detected=False)
         
         try:
-            # Detect face using robust cascade classifier with preprocessing
-            faces = self.detect_faces_cascade(frame)
-            face_detected = len(faces) > 0
-            
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            
-            if self.use_mediapipe:
-                try:
-                    results = self.face_mesh.process(frame_rgb)
-                    
-                    if results.multi_face_landmarks:
-                        landmarks = np.array([
-                            [lm.x, lm.y, lm.z] for lm in results.multi_face_landmarks[0].landmark
-                        ])
-                    else:
-                        landmarks = None
-                except Exception:
-                    landmarks = None
+            if pre is not None:
+                gray = pre.gray
+                faces = pre.faces
+                landmarks = pre.landmarks
             else:
-                landmarks = None
+                gray = to_gray(frame)
+                # FaceMesh when available, otherwise the cascade classifier
+                faces, landmarks = locate_face(frame, gray, self.face_mesh if self.use_mediapipe else None,
+                                               self.cascade_cache)
+            face_detected = len(faces) > 0
             
             # Perform liveness checks
             if landmarks is not None:
-                blink_detected, blink_conf = self.detect_blink(landmarks)
-                move_detected, move_conf, move_details = self.detect_head_movement(landmarks)
-                mouth_open, mouth_conf = self.detect_mouth_open(landmarks)
+                # No-op for FaceMesh output; keeps landmarks passed in by callers in
+                # the single layout the kernel is compiled for
+                landmarks = np.ascontiguousarray(landmarks, dtype=np.float32)
+                # One pass over the landmarks feeds all three detectors
+                stats = self._landmark_stats(landmarks) if len(landmarks) >= 400 else None
+                blink_detected, blink_conf = self.detect_blink(landmarks, stats)
+                move_detected, move_conf, move_details = self.detect_head_movement(landmarks, stats)
+                mouth_open, mouth_conf = self.detect_mouth_open(landmarks, stats)
             else:
                 # Use fallback motion detection when MediaPipe landmarks unavailable
                 blink_detected, blink_conf = False, 0.0
-                move_detected, move_conf, move_details = False, self.detect_motion_in_frame(frame), {"reason": "motion_fallback"}
+                motion = self.detect_motion_in_frame(frame, gray)
+                move_detected, move_conf, move_details = False, motion, {"reason": "motion_fallback"}
                 mouth_open, mouth_conf = False, 0.0
             
             # Calculate overall liveness score
@@ -334,76 +348,81 @@ class LivenessDetector:
             if landmarks is None and face_detected:
                 liveness_score = max(liveness_score, 0.5)
             
-            return {
-                "face_detected": face_detected,
-                "liveness_score": float(liveness_score),
-                "is_likely_live": liveness_score > self.confidence_threshold,
-                "detections": {
+            return LivenessAnalysis(
+                face_detected=face_detected,
+                liveness_score=float(liveness_score),
+                is_likely_live=bool(liveness_score > self.confidence_threshold),
+                detections={
                     "blink": {"detected": blink_detected, "confidence": float(blink_conf)},
                     "head_movement": {"detected": move_detected, "confidence": float(move_conf), "details": move_details},
                     "mouth_open": {"detected": mouth_open, "confidence": float(mouth_conf)}
                 }
-            }
+            )
         except Exception as e:
-            return {
-                "face_detected": False,
-                "liveness_score": 0.0,
-                "detections": {"error": str(e)}
-            }
+            return LivenessAnalysis(face_detected=False, detections={"error": str(e)})
     
     def generate_challenge(self, challenge_type: ChallengeType) -> Dict:
-        """Generate an interactive liveness challenge"""
-        challenges = {
-            ChallengeType.HEAD_TURN: {
-                "instruction": "Please turn your head to the left and then to the right",
-                "expected_actions": ["horizontal_turn"],
-                "timeout": 8.0
-            },
-            ChallengeType.BLINK: {
-                "instruction": "Please blink your eyes",
-                "expected_actions": ["blink"],
-                "timeout": 5.0
-            },
-            ChallengeType.MOUTH_OPEN: {
-                "instruction": "Please open your mouth",
-                "expected_actions": ["mouth_open"],
-                "timeout": 5.0
-            },
-            ChallengeType.SMILE: {
-                "instruction": "Please smile",
-                "expected_actions": ["smile"],
-                "timeout": 5.0
-            },
-            ChallengeType.NOD: {
-                "instruction": "Please nod your head",
-                "expected_actions": ["vertical_nod"],
-                "timeout": 5.0
-            }
-        }
-        
-        return challenges.get(challenge_type, {})
+        """Generate an interactive liveness challenge (a copy the caller may modify)"""
+        challenge = CHALLENGES.get(challenge_type)
+        if challenge is None:
+            return {}
+        return {**challenge, "expected_actions": list(challenge["expected_actions"])}
     
-    def calculate_liveness_confidence(self, detections: List[Dict]) -> float:
+    def calculate_liveness_confidence(self, detections: List[LivenessAnalysis]) -> float:
         """
         Calculate overall liveness confidence from multiple detections.
         """
         if not detections:
             return 0.0
         
-        scores = [d["liveness_score"] for d in detections if d.get("face_detected")]
-        
-        if not scores:
+        scores = np.fromiter((d.liveness_score for d in detections if d.face_detected),
+                             dtype=np.float64)
+        if scores.size == 0:
             return 0.0
         
-        # Use average with decay for older frames
-        weighted_sum = sum(score * (0.9 ** i) for i, score in enumerate(reversed(scores)))
-        weight_sum = sum(0.9 ** i for i in range(len(scores)))
-        
-        return weighted_sum / weight_sum if weight_sum > 0 else 0.0
+        # Use average with decay for older frames (newest weighs 1, then 0.9, 0.81, ...)
+        weights = np.power(0.9, np.arange(scores.size - 1, -1, -1, dtype=np.float64))
+        return float(scores @ weights / weights.sum())
+    
+    def process_batch(self, frames: List[np.ndarray],
+                      pres: Optional[List[PreprocessedFrame]] = None) -> List[LivenessAnalysis]:
+        """
+        Process several consecutive frames in one call.
+        Frames are analyzed in order so temporal history stays consistent.
+        """
+        if pres is None:
+            return [self.process_frame(frame) for frame in frames]
+        return [self.process_frame(frame, pre) for frame, pre in zip(frames, pres)]
+    
+    def close(self):
+        """
+        Release this detector's per-stream state.
+        The shared FaceMesh stays open for other detectors; it is closed at exit.
+        """
+        self.reset()
+        self.face_mesh = None
+        self.use_mediapipe = False
+        self._diff_buf = None
+        self._motion_sample = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
     def reset(self):
-        """Reset detector state"""
+        """Reset detector state (the FaceMesh is kept, not rebuilt)"""
+        self.cascade_cache.reset()
         self.prev_frame_landmarks = None
+        self._prev_xy = None
+        self._prev_gray = None
         self.challenge_history = []
         self.blink_counter = 0
         self.eye_closed_frames = 0
+
+
+if NUMBA_AVAILABLE:
+    # Compile (or load from the on-disk cache) at import rather than on the first frame
+    _landmark_stats(np.zeros((468, 3), dtype=np.float32), LivenessDetector._EAR_I1,
+                    LivenessDetector._EAR_I2, LivenessDetector._MOUTH_TOP, LivenessDetector._MOUTH_BOTTOM)
@@ -5,15 +5,24 @@ Implements escalation policies and incident management.
 """
 import logging
 import json
-from typing import Dict, List, Optional
-from datetime import datetime
-from dataclasses import dataclass, asdict
+from collections import Counter, OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from dataclasses import dataclass, fields
 from enum import Enum
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import queue
 import threading
+import time
+
+from app.utils.timestamps import now_ns, precise_now_iso
+
+# Try to import orjson, fallback to the standard json module if not available
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -56,6 +65,44 @@ class Alert:
     acknowledged_by: Optional[str] = None
 
 
+_SEVERITY_RANK = {severity: rank for rank, severity in enumerate(AlertSeverity)}
+
+_ALERT_FIELDS = tuple(f.name for f in fields(Alert))
+
+
+def _alert_to_dict(alert: Alert) -> Dict:
+    """
+    Shallow dict of an alert for API responses; unlike asdict() it does not
+    deep-copy the details, and enums are reduced to their values
+    """
+    result = {name: getattr(alert, name) for name in _ALERT_FIELDS}
+    result["alert_type"] = alert.alert_type.value
+    result["severity"] = alert.severity.value
+    return result
+
+
+SLACK_COLORS = {
+    AlertSeverity.LOW: "#36a64f",
+    AlertSeverity.MEDIUM: "#ff9900",
+    AlertSeverity.HIGH: "#ff6600",
+    AlertSeverity.CRITICAL: "#cc0000"
+}
+
+
+def _dumps(obj, indent: bool = False) -> str:
+    """Serialize with orjson when available (it also handles NumPy values)"""
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, option=option).decode()
+        except TypeError:
+            # e.g. integers beyond 64 bits; let the json module have a go
+            pass
+    return json.dumps(obj, indent=2 if indent else None)
+
+
 class SpoofAlertingService:
     """
     Manages detection alerts and notifications
@@ -64,14 +111,37 @@ class SpoofAlertingService:
     def __init__(self, 
                  email_config: Optional[Dict] = None,
                  slack_webhook: Optional[str] = None,
-                 database_path: Optional[str] = None):
+                 database_path: Optional[str] = None,
+                 digest_interval: float = 0.5,
+                 max_history: int = 10000):
         self.email_config = email_config or {}
         self.slack_webhook = slack_webhook
         self.database_path = database_path
         
-        # Alert history
-        self.alerts: List[Alert] = []
-        self.alert_queue = queue.Queue()
+        # Email and Slack alerts raised within digest_interval seconds of each
+        # other go out as one message per channel (and recipient list).
+        # Only the processor thread touches the digests.
+        self.digest_interval = digest_interval
+        self._digests: Dict[Tuple[str, Tuple[str, ...]], List[Alert]] = {}
+        self._digest_deadline = 0.0
+        
+        # The last max_history alerts, plus an id index, the still-active alerts
+        # (in creation order) and running counts over every alert ever raised,
+        # so lookups and statistics don't rescan the history
+        self.alerts: Deque[Alert] = deque(maxlen=max_history)
+        self._index: Dict[str, Alert] = {}
+        self._active: Dict[str, Alert] = {}
+        self._by_severity: Counter = Counter()
+        self._by_type: Counter = Counter()
+        self._lock = threading.Lock()
+        # Latest alert per (session, type) with its monotonic creation time,
+        # oldest first, for suppressing repeats within multiple_alerts_window
+        self._recent: "OrderedDict[Tuple[str, AlertType], Tuple[float, Alert]]" = OrderedDict()
+        self._suppressed = 0
+        # Alerts waiting for notification. deque append/popleft are atomic, so
+        # producers never take a lock; the event only wakes the processor.
+        self.alert_queue: Deque[Alert] = deque()
+        self._alerts_pending = threading.Event()
         
         # Start alert processor thread
         self.alert_processor_thread = threading.Thread(
@@ -126,63 +196,101 @@ class SpoofAlertingService:
                     message: str,
                     details: Dict,
                     user_id: Optional[str] = None) -> Alert:
-        """Create a new alert"""
-        alert_id = f"{session_id}_{datetime.now().isoformat()}"
+        """
+        Create a new alert.
+        A repeat of a still-active alert of the same type for the same session
+        within multiple_alerts_window seconds, at the same or a lower severity,
+        is not recorded or notified again; the existing alert is returned.
+        """
+        alert_id = f"{session_id}_{now_ns()}"
         
         alert = Alert(
             alert_id=alert_id,
             alert_type=alert_type,
             severity=severity,
-            timestamp=datetime.now().isoformat(),
+            timestamp=precise_now_iso(),
             user_id=user_id,
             session_id=session_id,
             message=message,
             details=details
         )
         
-        self.alert_queue.put(alert)
-        self.alerts.append(alert)
+        # The dedup check and the insert form one critical section so two
+        # threads raising the same alert cannot both get past the check
+        key = (session_id, alert_type)
+        with self._lock:
+            now = time.monotonic()
+            self._prune_recent(now)
+            recent = self._recent.get(key)
+            if recent is not None:
+                existing = recent[1]
+                if (existing.status == "active" and
+                        _SEVERITY_RANK[severity] <= _SEVERITY_RANK[existing.severity]):
+                    self._suppressed += 1
+                    return existing
+            
+            if len(self.alerts) == self.alerts.maxlen:
+                evicted = self.alerts[0]
+                self._index.pop(evicted.alert_id, None)
+                self._active.pop(evicted.alert_id, None)
+            self.alerts.append(alert)
+            self._index[alert_id] = alert
+            self._active[alert_id] = alert
+            self._by_severity[severity] += 1
+            self._by_type[alert_type] += 1
+            self._recent[key] = (now, alert)
+            self._recent.move_to_end(key)
+        self.alert_queue.append(alert)
+        self._alerts_pending.set()
         
         logger.warning(f"Alert created: {alert_type.value} - {message}")
         
         return alert
     
+    def _prune_recent(self, now: float):
+        """Forget dedup entries older than the window (caller holds _lock)"""
+        window = self.thresholds["multiple_alerts_window"]
+        while self._recent:
+            created, _ = next(iter(self._recent.values()))
+            if now - created < window:
+                break
+            self._recent.popitem(last=False)
+    
     def determine_alert_severity(self, 
                                 deepfake_score: float,
                                 liveness_score: float,
                                 indicators: Dict) -> AlertSeverity:
         """
         Determine alert severity based on detection scores and indicators
+        Thresholds are inclusive; levels are checked from the most severe down
+        and each indicator is only looked up when a level needs it.
         """
-        critical_indicators = [
-            deepfake_score > 0.85,
-            liveness_score < 0.2,
-            indicators.get("blink_pattern_anomaly", 0) > 0.8,
-            indicators.get("texture_anomaly", 0) > 0.9,
-            indicators.get("face_not_detected", False)
-        ]
-        
-        high_indicators = [
-            deepfake_score > 0.7,
-            liveness_score < 0.35,
-            indicators.get("texture_anomaly", 0) > 0.7,
-            indicators.get("geometry_inconsistency", 0) > 0.8
-        ]
+        # A confident deepfake score is critical on its own
+        if deepfake_score >= 0.85:
+            return AlertSeverity.CRITICAL
         
-        medium_indicators = [
-            deepfake_score > 0.55,
-            liveness_score < 0.5,
-            indicators.get("temporal_anomaly", 0) > 0.6
-        ]
+        texture_anomaly = indicators.get("texture_anomaly", 0)
         
-        if sum(critical_indicators) >= 2 or deepfake_score > 0.85:
+        critical_hits = ((liveness_score <= 0.2) +
+                         (indicators.get("blink_pattern_anomaly", 0) >= 0.8) +
+                         (texture_anomaly >= 0.9) +
+                         bool(indicators.get("face_not_detected", False)))
+        if critical_hits >= 2:
             return AlertSeverity.CRITICAL
-        elif sum(high_indicators) >= 2 or deepfake_score > 0.75:
+        
+        if deepfake_score >= 0.75:
+            return AlertSeverity.HIGH
+        high_hits = ((deepfake_score >= 0.7) +
+                     (liveness_score <= 0.35) +
+                     (texture_anomaly >= 0.7) +
+                     (indicators.get("geometry_inconsistency", 0) >= 0.8))
+        if high_hits >= 2:
             return AlertSeverity.HIGH
-        elif sum(medium_indicators) >= 1:
+        
+        if (deepfake_score >= 0.55 or liveness_score <= 0.5 or
+                indicators.get("temporal_anomaly", 0) >= 0.6):
             return AlertSeverity.MEDIUM
-        else:
-            return AlertSeverity.LOW
+        return AlertSeverity.LOW
     
     def evaluate_verification_result(self,
                                    session_id: str,
@@ -219,7 +327,7 @@ class SpoofAlertingService:
                 user_id=user_id
             )
             
-            verification_result["alerts"].append(asdict(alert))
+            verification_result["alerts"].append(_alert_to_dict(alert))
             verification_result["recommendations"].append("REJECT - Deepfake indicators detected")
         
         # Check for liveness
@@ -233,7 +341,7 @@ class SpoofAlertingService:
                 user_id=user_id
             )
             
-            verification_result["alerts"].append(asdict(alert))
+            verification_result["alerts"].append(_alert_to_dict(alert))
             verification_result["recommendations"].append("REJECT - Liveness verification failed")
         
         # Check for multiple face detection anomalies
@@ -247,7 +355,7 @@ class SpoofAlertingService:
                 user_id=user_id
             )
             
-            verification_result["alerts"].append(asdict(alert))
+            verification_result["alerts"].append(_alert_to_dict(alert))
             verification_result["recommendations"].append("REJECT - Face not detected")
         
         # Determine overall verification status
@@ -264,26 +372,33 @@ class SpoofAlertingService:
     def _process_alerts(self):
         """Background thread to process alerts"""
         while True:
-            try:
-                alert = self.alert_queue.get(timeout=1)
-                
-                # Get escalation policy
-                policy = self.escalation_policies.get(
-                    alert.severity,
-                    self.escalation_policies[AlertSeverity.LOW]
-                )
-                
-                # Send notifications based on policy
-                self._send_notifications(alert, policy)
-                
-                # Log to database if configured
-                if self.database_path:
-                    self._log_to_database(alert)
-                
-            except queue.Empty:
-                continue
-            except Exception as e:
-                logger.error(f"Error processing alert: {str(e)}")
+            # Sleep until an alert arrives or a digest is due; anything queued
+            # after clear() is either drained below or sets the event again
+            timeout = max(self._digest_deadline - time.monotonic(), 0.0) if self._digests else None
+            self._alerts_pending.wait(timeout)
+            self._alerts_pending.clear()
+            
+            while self.alert_queue:
+                alert = self.alert_queue.popleft()
+                try:
+                    # Get escalation policy
+                    policy = self.escalation_policies.get(
+                        alert.severity,
+                        self.escalation_policies[AlertSeverity.LOW]
+                    )
+                    
+                    # Send notifications based on policy
+                    self._send_notifications(alert, policy)
+                    
+                    # Log to database if configured
+                    if self.database_path:
+                        self._log_to_database(alert)
+                    
+                except Exception as e:
+                    logger.error(f"Error processing alert: {str(e)}")
+            
+            if self._digests and time.monotonic() >= self._digest_deadline:
+                self._flush_digests()
     
     def _send_notifications(self, alert: Alert, policy: Dict):
         """Send notifications based on escalation policy"""
@@ -294,16 +409,33 @@ class SpoofAlertingService:
                 if channel == "log":
                     self._log_alert(alert)
                 elif channel == "email":
-                    recipients = policy.get("recipients", [])
-                    self._send_email_alert(alert, recipients)
+                    self._add_to_digest("email", tuple(policy.get("recipients", [])), alert)
                 elif channel == "slack":
-                    self._send_slack_alert(alert)
+                    self._add_to_digest("slack", (), alert)
                 elif channel == "sms":
                     phone_numbers = policy.get("phone_numbers", [])
                     self._send_sms_alert(alert, phone_numbers)
             except Exception as e:
                 logger.error(f"Error sending {channel} alert: {str(e)}")
     
+    def _add_to_digest(self, channel: str, recipients: Tuple[str, ...], alert: Alert):
+        """Queue an alert for the next digest of a channel"""
+        if not self._digests:
+            self._digest_deadline = time.monotonic() + self.digest_interval
+        self._digests.setdefault((channel, recipients), []).append(alert)
+    
+    def _flush_digests(self):
+        """Send every pending digest, one message per channel and recipient list"""
+        digests, self._digests = self._digests, {}
+        for (channel, recipients), alerts in digests.items():
+            try:
+                if channel == "email":
+                    self._send_email_alert(alerts, list(recipients))
+                elif channel == "slack":
+                    self._send_slack_alert(alerts)
+            except Exception as e:
+                logger.error(f"Error sending {channel} alert: {str(e)}")
+    
     def _log_alert(self, alert: Alert):
         """Log alert to application logs"""
         logger.warning(
@@ -311,13 +443,16 @@ class SpoofAlertingService:
             f"{alert.message} (Session: {alert.session_id})"
         )
     
-    def _send_email_alert(self, alert: Alert, recipients: List[str]):
-        """Send email alert (placeholder - implement with your email service)"""
+    def _send_email_alert(self, alerts: List[Alert], recipients: List[str]):
+        """Send one email for a digest of alerts (placeholder - implement with your email service)"""
         if not self.email_config or not recipients:
             return
         
-        subject = f"[{alert.severity.value.upper()}] KYC Verification Alert"
-        body = self._format_alert_email(alert)
+        if len(alerts) == 1:
+            subject = f"[{alerts[0].severity.value.upper()}] KYC Verification Alert"
+        else:
+            subject = f"[{self._highest_severity(alerts).value.upper()}] {len(alerts)} KYC Verification Alerts"
+        body = "\n".join(self._format_alert_email(alert) for alert in alerts)
         
         logger.info(f"Email alert would be sent to {recipients}: {subject}")
         # TODO: Integrate with email service (SendGrid, AWS SES, etc.)
@@ -336,27 +471,24 @@ Timestamp: {alert.timestamp}
 Message: {alert.message}
 
 Details:
-{json.dumps(alert.details, indent=2)}
+{_dumps(alert.details, indent=True)}
 
 Action Required: Manual review recommended
         """
     
-    def _send_slack_alert(self, alert: Alert):
-        """Send Slack webhook alert (placeholder - implement with your Slack workspace)"""
+    @staticmethod
+    def _highest_severity(alerts: List[Alert]) -> AlertSeverity:
+        return max((alert.severity for alert in alerts), key=_SEVERITY_RANK.__getitem__)
+    
+    def _send_slack_alert(self, alerts: List[Alert]):
+        """Send one Slack webhook message for a digest of alerts (placeholder - implement with your Slack workspace)"""
         if not self.slack_webhook:
             return
         
-        severity_color = {
-            AlertSeverity.LOW: "#36a64f",
-            AlertSeverity.MEDIUM: "#ff9900",
-            AlertSeverity.HIGH: "#ff6600",
-            AlertSeverity.CRITICAL: "#cc0000"
-        }
-        
         slack_message = {
             "attachments": [
                 {
-                    "color": severity_color.get(alert.severity, "#999999"),
+                    "color": SLACK_COLORS.get(alert.severity, "#999999"),
                     "title": f"KYC Alert: {alert.alert_type.value}",
                     "text": alert.message,
                     "fields": [
@@ -366,10 +498,12 @@ Action Required: Manual review recommended
                         {"title": "Timestamp", "value": alert.timestamp, "short": True}
                     ]
                 }
+                for alert in alerts
             ]
         }
         
-        logger.info(f"Slack alert would be sent: {slack_message}")
+        payload = _dumps(slack_message)
+        logger.info(f"Slack alert would be sent: {payload}")
         # TODO: Integrate with Slack webhook
     
     def _send_sms_alert(self, alert: Alert, phone_numbers: List[str]):
@@ -390,38 +524,44 @@ Action Required: Manual review recommended
         except Exception as e:
             logger.error(f"Error logging alert to database: {str(e)}")
     
+    def reset(self):
+        """Forget the alert history, statistics and dedup state (the processor thread keeps running)"""
+        with self._lock:
+            self.alerts.clear()
+            self._index.clear()
+            self._active.clear()
+            self._by_severity.clear()
+            self._by_type.clear()
+            self._recent.clear()
+            self._suppressed = 0
+    
     def acknowledge_alert(self, alert_id: str, acknowledged_by: str) -> bool:
         """Acknowledge an alert"""
-        for alert in self.alerts:
-            if alert.alert_id == alert_id:
-                alert.status = "acknowledged"
-                alert.acknowledged_at = datetime.now().isoformat()
-                alert.acknowledged_by = acknowledged_by
-                
-                logger.info(f"Alert {alert_id} acknowledged by {acknowledged_by}")
-                return True
+        with self._lock:
+            alert = self._index.get(alert_id)
+            if alert is None:
+                return False
+            alert.status = "acknowledged"
+            alert.acknowledged_at = precise_now_iso()
+            alert.acknowledged_by = acknowledged_by
+            self._active.pop(alert_id, None)
         
-        return False
+        logger.info(f"Alert {alert_id} acknowledged by {acknowledged_by}")
+        return True
     
     def get_active_alerts(self) -> List[Dict]:
         """Get all active alerts"""
-        return [asdict(a) for a in self.alerts if a.status == "active"]
+        with self._lock:
+            active = list(self._active.values())
+        return [_alert_to_dict(a) for a in active]
     
     def get_alert_statistics(self) -> Dict:
         """Get alert statistics"""
-        stats = {
-            "total_alerts": len(self.alerts),
-            "active_alerts": len([a for a in self.alerts if a.status == "active"]),
-            "by_severity": {},
-            "by_type": {}
-        }
-        
-        for severity in AlertSeverity:
-            count = len([a for a in self.alerts if a.severity == severity])
-            stats["by_severity"][severity.value] = count
-        
-        for alert_type in AlertType:
-            count = len([a for a in self.alerts if a.alert_type == alert_type])
-            stats["by_type"][alert_type.value] = count
-        
-        return stats
+        with self._lock:
+            return {
+                "total_alerts": sum(self._by_severity.values()),
+                "active_alerts": len(self._active),
+                "by_severity": {severity.value: self._by_severity[severity] for severity in AlertSeverity},
+                "by_type": {alert_type.value: self._by_type[alert_type] for alert_type in AlertType},
+                "suppressed_duplicates": self._suppressed
+            }
@@ -24,6 +24,21 @@ class Config:
     TARGET_FPS = 30
     TARGET_RESOLUTION = (640, 480)
     
+    # Background frame analysis
+    # Analyze every Nth uploaded frame. The web client uploads ~10 fps and the blink
+    # checks count frames, so skipping frames makes normal blinks look abnormal
+    ANALYSIS_STRIDE = int(os.environ.get('ANALYSIS_STRIDE', 1))
+    ANALYSIS_INPUT_SIZE = (640, 360)  # Uploaded JPEGs are downscaled while decoding, never below this
+    ANALYSIS_BATCH_SIZE = 8  # Max queued frames handed to the detectors at once
+    ANALYSIS_QUEUE_SIZE = 256
+    ANALYSIS_QUEUE_TIMEOUT = 1.0  # seconds to wait for a queue slot
+    ANALYSIS_WAIT_TIMEOUT = 30.0  # seconds to wait for pending frames on completion
+    JPEG_DECODE_DEVICE = os.environ.get('JPEG_DECODE_DEVICE', 'cpu')  # 'cuda' batch-decodes queued frames with nvJPEG
+    FRAME_RETENTION = int(os.environ.get('FRAME_RETENTION', 0))  # Decoded frames kept per session for re-analysis (0 = off)
+    FRAME_BUFFER_DIR = os.environ.get('FRAME_BUFFER_DIR')  # Defaults to /dev/shm when available
+    YUNET_MODEL_PATH = os.environ.get('YUNET_MODEL_PATH')  # face_detection_yunet ONNX model; replaces the Haar cascade when set
+    FACE_MESH_ONNX_PATH = os.environ.get('FACE_MESH_ONNX_PATH')  # FaceMesh landmark model exported to ONNX; replaces MediaPipe when set (needs onnxruntime)
+    
     # Detection thresholds
     LIVENESS_THRESHOLD = 0.5
     DEEPFAKE_THRESHOLD = 0.6
@@ -43,12 +58,29 @@ class Config:
     # Slack webhook (if enabled)
     SLACK_WEBHOOK_URL = os.environ.get('SLACK_WEBHOOK_URL')
     
+    # Session storage (Redis is used when REDIS_URL is set)
+    REDIS_URL = os.environ.get('REDIS_URL')
+    SESSION_TTL = int(os.environ.get('SESSION_TTL', 3600))  # seconds
+    MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 10000))  # in-memory store only
+    SESSION_PURGE_INTERVAL = 60  # seconds between expired-session sweeps
+    
     # Database
     DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///kyc_verification.db')
     
     # Logging
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
     LOG_FILE = os.path.join(BASE_DIR, 'logs', 'kyc_verification.log')
+    
+    _dirs_created = False
+    
+    @classmethod
+    def ensure_dirs(cls):
+        """Create the upload, temp and log directories (once per process, at server start)"""
+        if Config._dirs_created:
+            return
+        for directory in (cls.UPLOAD_FOLDER, cls.TEMP_FOLDER, os.path.dirname(cls.LOG_FILE)):
+            Path(directory).mkdir(parents=True, exist_ok=True)
+        Config._dirs_created = True
 
 
 class DevelopmentConfig(Config):
@@ -65,9 +97,3 @@ class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
     DATABASE_URL = 'sqlite:///:memory:'
-
-
-# Create directories
-os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(Config.TEMP_FOLDER, exist_ok=True)
-os.makedirs(os.path.dirname(Config.LOG_FILE), exist_ok=True)
@@ -0,0 +1,65 @@
+"""
+Frame Ring Buffer
+Keeps the most recent decoded frames of a session in a memory-mapped file
+(on tmpfs when available) instead of on the Python heap
+"""
+import os
+import tempfile
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.utils.video_processor import letterbox
+
+
+def default_buffer_dir() -> str:
+    """Prefer tmpfs so retained frames only ever live in the page cache"""
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+class FrameRingBuffer:
+    """
+    Fixed-size ring of BGR frames backed by a numpy.memmap.
+    Frames are written into pre-allocated slots, so RSS stays flat no matter
+    how long a session runs; only the newest `capacity` frames are kept.
+    """
+
+    def __init__(self, capacity: int, frame_size: Tuple[int, int], directory: Optional[str] = None):
+        width, height = frame_size
+        fd, self.path = tempfile.mkstemp(prefix='kyc-frames-', suffix='.raw',
+                                         dir=directory or default_buffer_dir())
+        os.close(fd)
+
+        self.capacity = capacity
+        self.frames = np.memmap(self.path, dtype=np.uint8, mode='w+',
+                                shape=(capacity, height, width, 3))
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def write(self, frame: np.ndarray) -> int:
+        """Copy a frame into the next slot (letterboxed if its size differs) and return its index"""
+        with self._lock:
+            index = self.count
+            self.count += 1
+
+        slot = self.frames[index % self.capacity]
+        if frame.shape == slot.shape:
+            slot[...] = frame
+        else:
+            letterbox(frame, (slot.shape[1], slot.shape[0]), dst=slot)
+        return index
+
+    def read(self, index: int) -> Optional[np.ndarray]:
+        """Zero-copy view of a stored frame, or None if it was overwritten or never written"""
+        if index < 0 or index >= self.count or index < self.count - self.capacity:
+            return None
+        return self.frames[index % self.capacity]
+
+    def close(self):
+        """Release the mapping and delete the backing file"""
+        self.frames = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
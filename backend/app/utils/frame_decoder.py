@@ -0,0 +1,151 @@
+"""
+Frame Decoding Utilities
+Decodes uploaded video frames, preferring libjpeg-turbo when it is installed
+"""
+import base64
+import cv2
+import numpy as np
+from typing import Iterable, List, Optional, Tuple
+
+# Try to load libjpeg-turbo, fallback to OpenCV if not available
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    try:
+        _tj = TurboJPEG()
+        TURBOJPEG_AVAILABLE = True
+    except (OSError, RuntimeError):
+        TURBOJPEG_AVAILABLE = False
+except ImportError:
+    TURBOJPEG_AVAILABLE = False
+
+# Try to import torchvision's nvJPEG bindings, fallback to CPU decoding if not available
+try:
+    import torch
+    import torch.nn.functional as F
+    from torchvision.io import decode_jpeg as _tv_decode_jpeg, ImageReadMode
+    NVJPEG_AVAILABLE = torch.cuda.is_available()
+except ImportError:
+    NVJPEG_AVAILABLE = False
+
+# DCT-domain downscales OpenCV's JPEG decoder supports
+OPENCV_REDUCED_FLAGS = {
+    (1, 2): cv2.IMREAD_REDUCED_COLOR_2,
+    (1, 4): cv2.IMREAD_REDUCED_COLOR_4,
+    (1, 8): cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# JPEG start-of-frame markers (baseline, extended, progressive, lossless...)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(buf: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Read (width, height) from a JPEG header without decoding it.
+    Returns None if the buffer is not a JPEG.
+    """
+    if len(buf) < 4 or buf[0] != 0xFF or buf[1] != 0xD8:
+        return None
+
+    i = 2
+    while i + 9 < len(buf):
+        if buf[i] != 0xFF:
+            return None
+        marker = buf[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+            continue
+        if marker in _SOF_MARKERS:
+            height = (buf[i + 5] << 8) | buf[i + 6]
+            width = (buf[i + 7] << 8) | buf[i + 8]
+            return width, height
+        segment_length = (buf[i + 2] << 8) | buf[i + 3]
+        i += 2 + segment_length
+
+    return None
+
+
+def pick_scaling_factor(size: Tuple[int, int],
+                        target_size: Tuple[int, int],
+                        factors: Iterable[Tuple[int, int]]) -> Optional[Tuple[int, int]]:
+    """
+    Pick the strongest downscale that keeps the frame at least as large as
+    target_size (orientation independent). Returns None for full size.
+    """
+    long_side, short_side = max(size), min(size)
+    target_long, target_short = max(target_size), min(target_size)
+
+    for num, den in sorted((f for f in factors if f[0] < f[1]), key=lambda f: f[0] / f[1]):
+        if long_side * num / den >= target_long and short_side * num / den >= target_short:
+            return num, den
+
+    return None
+
+
+def decode_jpeg(buf: bytes, target_size: Optional[Tuple[int, int]] = None) -> Optional[np.ndarray]:
+    """
+    Decode raw image bytes into a BGR frame.
+    When target_size (width, height) is given, JPEGs larger than it are
+    downscaled during decoding, which costs almost nothing extra.
+    Returns None if the bytes are not a decodable image.
+    """
+    if not buf:
+        return None
+
+    size = jpeg_size(buf) if target_size else None
+
+    if TURBOJPEG_AVAILABLE:
+        scaling_factor = pick_scaling_factor(size, target_size, _tj.scaling_factors) if size else None
+        try:
+            return _tj.decode(buf, pixel_format=TJPF_BGR, scaling_factor=scaling_factor)
+        except (OSError, ValueError):
+            # Not a JPEG (e.g. PNG) - let OpenCV handle it
+            pass
+
+    flags = cv2.IMREAD_COLOR
+    if size:
+        scaling_factor = pick_scaling_factor(size, target_size, OPENCV_REDUCED_FLAGS)
+        flags = OPENCV_REDUCED_FLAGS.get(scaling_factor, cv2.IMREAD_COLOR)
+
+    frame_array = np.frombuffer(buf, dtype=np.uint8)
+    return cv2.imdecode(frame_array, flags)
+
+
+def _decode_nvjpeg(bufs: List[bytes], target_size: Optional[Tuple[int, int]]) -> List[np.ndarray]:
+    """Decode a batch of JPEGs on the GPU and downscale them there before copying back"""
+    data = [torch.frombuffer(bytearray(buf), dtype=torch.uint8) for buf in bufs]
+    images = _tv_decode_jpeg(data, mode=ImageReadMode.RGB, device='cuda')
+
+    frames = []
+    for image in images:
+        size = (image.shape[2], image.shape[1])
+        scaling_factor = pick_scaling_factor(size, target_size, OPENCV_REDUCED_FLAGS) if target_size else None
+        if scaling_factor:
+            # Box filter, same as the DCT-domain reduction on the CPU path
+            image = F.avg_pool2d(image[None].float(), scaling_factor[1])[0].to(torch.uint8)
+        # CHW RGB -> HWC BGR, the layout the detectors expect
+        frames.append(image.flip(0).permute(1, 2, 0).contiguous().cpu().numpy())
+    return frames
+
+
+def decode_jpeg_batch(bufs: List[bytes],
+                      target_size: Optional[Tuple[int, int]] = None,
+                      device: str = 'cpu') -> List[Optional[np.ndarray]]:
+    """
+    Decode several frames at once.
+    With device='cuda' and nvJPEG available the whole batch is decoded on the GPU;
+    otherwise (or if the batch contains an undecodable frame) each frame goes
+    through decode_jpeg. Undecodable frames come back as None.
+    """
+    if device == 'cuda' and NVJPEG_AVAILABLE and bufs:
+        try:
+            return _decode_nvjpeg(bufs, target_size)
+        except RuntimeError:
+            pass
+
+    return [decode_jpeg(buf, target_size) for buf in bufs]
+
+
+def decode_data_url(frame_data: str) -> bytes:
+    """Decode a base64 data URL (legacy JSON uploads) into raw image bytes"""
+    return base64.b64decode(frame_data.split(',')[1] if ',' in frame_data else frame_data)
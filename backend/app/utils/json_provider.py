@@ -0,0 +1,30 @@
+"""
+JSON Serialization
+Flask JSON provider backed by orjson when it is installed
+"""
+from typing import Any
+
+from flask.json.provider import JSONProvider
+
+# Try to import orjson, fallback to Flask's default provider if not available
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    Serializes responses with orjson, which also handles NumPy scalars/arrays,
+    enums and dataclasses found in analysis results without manual conversion.
+    """
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(
+            obj,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        ).decode()
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
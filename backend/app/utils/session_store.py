@@ -0,0 +1,301 @@
+"""
+Session Storage
+Keeps KYC verification session state either in process memory or in Redis
+so that several API workers/hosts can share sessions.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, fields as dataclass_fields, is_dataclass, replace
+from enum import Enum
+from typing import Dict, List, Optional
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Try to import Redis + msgpack, fallback to in-memory storage if not available
+try:
+    import redis
+    import msgpack
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+@dataclass(slots=True)
+class Session:
+    """Verification session state"""
+    user_id: str
+    session_id: str
+    created_at: str
+    status: str = "active"
+    frame_count: int = 0
+    frames_processed: int = 0
+    liveness_sum: float = 0.0
+    liveness_frames: int = 0
+    deepfake_sum: float = 0.0
+    deepfake_frames: int = 0
+    current_challenge: Optional[Dict] = None
+    last_analysis: Optional[Dict] = None
+    verification_result: Optional[Dict] = None
+
+
+SESSION_FIELDS = frozenset(f.name for f in dataclass_fields(Session))
+
+
+class InMemorySessionStore:
+    """
+    Process-local session store.
+    Only suitable for a single API process.
+    Sessions expire after `ttl` seconds without writes, and the least
+    recently written session is evicted once `maxsize` is exceeded.
+    """
+
+    def __init__(self, ttl: int = 3600, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # Ordered from least to most recently written
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._expires: Dict[str, float] = {}
+        self._frames: Dict[str, List[Dict]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is None or self._expires[session_id] <= time.monotonic():
+            return None
+        return session
+
+    def _touch(self, session_id: str):
+        self._sessions.move_to_end(session_id)
+        self._expires[session_id] = time.monotonic() + self.ttl
+
+    def _drop(self, session_id: str):
+        del self._sessions[session_id]
+        del self._expires[session_id]
+        del self._frames[session_id]
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return self._live(session_id) is not None
+
+    def create(self, session: Session):
+        """Store a new session, evicting the least recently written ones if full"""
+        with self._lock:
+            self._sessions[session.session_id] = replace(session)
+            self._frames[session.session_id] = []
+            self._touch(session.session_id)
+            while len(self._sessions) > self.maxsize:
+                evicted = next(iter(self._sessions))
+                self._drop(evicted)
+                logger.warning(f"Session store full, evicted session {evicted}")
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Get a snapshot of a session, or None if it does not exist"""
+        with self._lock:
+            session = self._live(session_id)
+            return replace(session) if session is not None else None
+
+    def update(self, session_id: str, fields: Dict):
+        """Overwrite session fields"""
+        with self._lock:
+            session = self._live(session_id)
+            if session is not None:
+                for field, value in fields.items():
+                    setattr(session, field, value)
+                self._touch(session_id)
+
+    def incr(self, session_id: str, field: str, amount: float = 1):
+        """Atomically increment a numeric session field and return the new value, or None if the session is gone"""
+        with self._lock:
+            session = self._live(session_id)
+            if session is None:
+                return None
+            value = getattr(session, field) + amount
+            setattr(session, field, value)
+            self._touch(session_id)
+            return value
+
+    def record_analysis(self, session_id: str, entry: Dict, fields: Dict, increments: Dict):
+        """Append a frame analysis and apply the related field updates in one step"""
+        with self._lock:
+            session = self._live(session_id)
+            if session is None:
+                return
+            self._frames[session_id].append(entry)
+            session.frames_processed += 1
+            for field, value in fields.items():
+                setattr(session, field, value)
+            for field, amount in increments.items():
+                setattr(session, field, getattr(session, field) + amount)
+            self._touch(session_id)
+
+    def discard_frames(self, session_id: str):
+        """Free the per-frame analyses of a session, keeping its summary"""
+        with self._lock:
+            if session_id in self._frames:
+                self._frames[session_id] = []
+
+    def purge_expired(self) -> int:
+        """Remove expired sessions and return how many were removed"""
+        now = time.monotonic()
+        purged = 0
+        with self._lock:
+            # Every write pushes the expiry out by the same ttl, so expiry follows write order
+            while self._sessions:
+                session_id = next(iter(self._sessions))
+                if self._expires[session_id] > now:
+                    break
+                self._drop(session_id)
+                purged += 1
+        return purged
+
+
+def _to_builtin(obj):
+    """msgpack fallback for NumPy scalars/arrays, enums and dataclasses found in analysis results"""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, Enum):
+        return obj.value
+    if is_dataclass(obj):
+        return asdict(obj)
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+
+class RedisSessionStore:
+    """
+    Redis-backed session store.
+    Each session is a hash of msgpack-encoded fields, a hash of numeric
+    counters (updated with HINCRBY/HINCRBYFLOAT) and a list of frame analyses.
+    All keys expire after `ttl` seconds of inactivity.
+    """
+
+    def __init__(self, url: str, ttl: int = 3600, prefix: str = "kyc:session:"):
+        self.redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _keys(self, session_id: str):
+        key = f"{self.prefix}{session_id}"
+        return key, f"{key}:counters", f"{key}:frames"
+
+    @staticmethod
+    def _pack(value) -> bytes:
+        return msgpack.packb(value, default=_to_builtin)
+
+    def _touch(self, pipe, session_id: str):
+        for key in self._keys(session_id):
+            pipe.expire(key, self.ttl)
+
+    def __contains__(self, session_id: str) -> bool:
+        return bool(self.redis.exists(self._keys(session_id)[0]))
+
+    def create(self, session: Session):
+        """Store a new session; numeric fields become counters"""
+        key, counters_key, _ = self._keys(session.session_id)
+        values = asdict(session)
+        counters = {k: v for k, v in values.items()
+                    if isinstance(v, (int, float)) and not isinstance(v, bool)}
+        fields = {k: self._pack(v) for k, v in values.items() if k not in counters}
+
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping=fields)
+        if counters:
+            pipe.hset(counters_key, mapping=counters)
+        self._touch(pipe, session.session_id)
+        pipe.execute()
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Get a snapshot of a session, or None if it does not exist"""
+        key, counters_key, _ = self._keys(session_id)
+
+        pipe = self.redis.pipeline()
+        pipe.hgetall(key)
+        pipe.hgetall(counters_key)
+        fields, counters = pipe.execute()
+
+        if not fields:
+            return None
+
+        values = {k.decode(): msgpack.unpackb(v) for k, v in fields.items()}
+        for k, v in counters.items():
+            try:
+                values[k.decode()] = int(v)
+            except ValueError:
+                values[k.decode()] = float(v)
+        # Ignore fields written by other versions of the app
+        return Session(**{k: v for k, v in values.items() if k in SESSION_FIELDS})
+
+    def update(self, session_id: str, fields: Dict):
+        """Overwrite session fields"""
+        key = self._keys(session_id)[0]
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping={k: self._pack(v) for k, v in fields.items()})
+        self._touch(pipe, session_id)
+        pipe.execute()
+
+    def incr(self, session_id: str, field: str, amount: float = 1):
+        """Atomically increment a numeric session field and return the new value, or None if the session is gone"""
+        key, counters_key, _ = self._keys(session_id)
+        with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # Abort if the session hash expires between the check and the increment,
+                    # otherwise HINCRBY would recreate a counters hash without a TTL
+                    pipe.watch(key)
+                    if not pipe.exists(key):
+                        return None
+                    pipe.multi()
+                    if isinstance(amount, int):
+                        pipe.hincrby(counters_key, field, amount)
+                    else:
+                        pipe.hincrbyfloat(counters_key, field, amount)
+                    self._touch(pipe, session_id)
+                    return pipe.execute()[0]
+                except redis.WatchError:
+                    continue
+
+    def record_analysis(self, session_id: str, entry: Dict, fields: Dict, increments: Dict):
+        """Append a frame analysis and apply the related field updates in one transaction"""
+        key, counters_key, frames_key = self._keys(session_id)
+
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.rpush(frames_key, self._pack(entry))
+        pipe.hincrby(counters_key, "frames_processed", 1)
+        if fields:
+            pipe.hset(key, mapping={k: self._pack(v) for k, v in fields.items()})
+        for field, amount in increments.items():
+            if isinstance(amount, int):
+                pipe.hincrby(counters_key, field, amount)
+            else:
+                pipe.hincrbyfloat(counters_key, field, amount)
+        self._touch(pipe, session_id)
+        pipe.execute()
+
+    def discard_frames(self, session_id: str):
+        """Free the per-frame analyses of a session, keeping its summary"""
+        self.redis.delete(self._keys(session_id)[2])
+
+    def purge_expired(self) -> int:
+        """Redis expires keys on its own"""
+        return 0
+
+
+def create_session_store(redis_url: Optional[str] = None, ttl: int = 3600, maxsize: int = 10000):
+    """Use Redis when a URL is configured, the client libraries are installed and the server answers"""
+    if redis_url:
+        if REDIS_AVAILABLE:
+            store = RedisSessionStore(redis_url, ttl=ttl)
+            try:
+                store.redis.ping()
+                logger.info("Using Redis session store")
+                return store
+            except redis.RedisError as e:
+                logger.warning(f"Cannot reach Redis at REDIS_URL ({str(e)}); using in-memory sessions")
+        else:
+            logger.warning("REDIS_URL is set but redis/msgpack are not installed; using in-memory sessions")
+    return InMemorySessionStore(ttl=ttl, maxsize=maxsize)
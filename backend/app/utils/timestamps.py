@@ -0,0 +1,33 @@
+"""
+Timestamp Helpers
+Cheap wall-clock timestamps for hot request paths
+"""
+import time
+from datetime import datetime
+
+
+def now_ns() -> int:
+    """Current wall-clock time in nanoseconds, for timestamps formatted later"""
+    return time.time_ns()
+
+
+def ns_to_iso(ts_ns: int) -> str:
+    """Format a now_ns() timestamp as ISO 8601"""
+    return datetime.fromtimestamp(ts_ns / 1e9).isoformat()
+
+
+# (second, ISO prefix of that second) of the last precise_now_iso() call
+_SECOND_ISO = [(0, '')]
+
+
+def precise_now_iso() -> str:
+    """
+    Current local time as ISO 8601 with microseconds.
+    The date/time part is only formatted once per second.
+    """
+    seconds, ns = divmod(time.time_ns(), 1_000_000_000)
+    cached_second, prefix = _SECOND_ISO[0]
+    if seconds != cached_second:
+        prefix = datetime.fromtimestamp(seconds).isoformat()
+        _SECOND_ISO[0] = (seconds, prefix)
+    return f"{prefix}.{ns // 1000:06d}"
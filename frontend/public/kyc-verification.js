@@ -238,17 +238,18 @@ class KYCVerificationSystem {
             const ctx = canvas.getContext('2d');
             ctx.drawImage(this.elements.webcam, 0, 0);
             
-            // Convert to base64
-            const frameData = canvas.toDataURL('image/jpeg', 0.7);
+            // Encode as a JPEG blob (sent as raw bytes, not base64)
+            const frameBlob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.7));
             
-            // Send to backend
+            // Send to backend as the raw request body; metadata goes in headers
             await fetch(`${this.apiBaseUrl}/kyc/upload-video-frame`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    session_id: this.sessionId,
-                    frame: frameData
-                })
+                headers: {
+                    'Content-Type': 'application/octet-stream',
+                    'X-Session-Id': this.sessionId,
+                    'X-Frame-Ts': String(Date.now())
+                },
+                body: frameBlob
             }).then(response => response.json())
               .then(data => {
                   this.updateAnalysisDisplay(data);
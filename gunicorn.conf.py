@@ -0,0 +1,26 @@
+"""
+Gunicorn configuration for the KYC Verification API
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# Frame analysis is CPU-bound OpenCV/MediaPipe work that releases the GIL,
+# so threaded workers are preferred over gevent/eventlet.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# One process: the analysis queue, pending-frame counts, retained frames and
+# the detectors' per-stream history are process-local, so every request of a
+# session has to reach the same process. Scale with threads instead.
+workers = 1
+
+# Each worker imports the app after forking so detectors, MediaPipe graphs
+# and background threads are created in the process that uses them.
+preload_app = False
+
+timeout = 120
+accesslog = '-'
+errorlog = '-'
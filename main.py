@@ -11,7 +11,7 @@ sys.path.insert(0, str(Path(__file__).parent / 'backend'))
 from app.app import app
 
 if __name__ == '__main__':
-    # Run the Flask app
+    # Run the Flask development server (use gunicorn with wsgi.py in production)
     app.run(
         host='0.0.0.0',
         port=5000,
@@ -2,18 +2,57 @@
 Test Suite for KYC Verification System
 """
 import unittest
+from unittest import mock
+import base64
+import io
 import json
+import os
+import queue
+import tempfile
+import time
 from datetime import datetime
-from app.services.liveness_detection import LivenessDetector, ChallengeType
-from app.services.deepfake_detection import DeepfakeDetector
+import cv2
+import numpy as np
+from app.services.liveness_detection import LivenessDetector, LivenessAnalysis, ChallengeType
+from app.services.deepfake_detection import DeepfakeDetector, DeepfakeAnalysis
+from app.services import deepfake_detection, liveness_detection
+from app.services.face_preprocessing import FacePreprocessor, PreprocessedFrame, _landmarks_from_wire
 from app.services.spoof_alerting import SpoofAlertingService, AlertType, AlertSeverity
+from app.utils import frame_decoder, session_store, video_processor
+from app.utils.config import Config
+from app.utils.frame_buffer import FrameRingBuffer
+from app.utils.frame_decoder import (
+    decode_jpeg, jpeg_size, pick_scaling_factor, OPENCV_REDUCED_FLAGS
+)
+from app.utils.session_store import (
+    InMemorySessionStore, RedisSessionStore, Session, create_session_store, REDIS_AVAILABLE
+)
+from app.utils.video_processor import VideoProcessor, _FrameStack
+
+# Try to import MediaPipe's landmark protos, skip the wire decoding tests if not available
+try:
+    from mediapipe.framework.formats import landmark_pb2
+    LANDMARK_PB2_AVAILABLE = True
+except ImportError:
+    LANDMARK_PB2_AVAILABLE = False
+
+# Try to import fakeredis, skip the Redis store tests if not available
+try:
+    import fakeredis
+    FAKEREDIS_AVAILABLE = True
+except ImportError:
+    FAKEREDIS_AVAILABLE = False
 
 
 class TestLivenessDetection(unittest.TestCase):
     """Test liveness detection functionality"""
     
+    @classmethod
+    def setUpClass(cls):
+        cls.detector = LivenessDetector()
+    
     def setUp(self):
-        self.detector = LivenessDetector()
+        self.detector.reset()
     
     def test_initialization(self):
         """Test detector initialization"""
@@ -39,8 +78,12 @@ class TestLivenessDetection(unittest.TestCase):
 class TestDeepfakeDetection(unittest.TestCase):
     """Test deepfake detection functionality"""
     
+    @classmethod
+    def setUpClass(cls):
+        cls.detector = DeepfakeDetector()
+    
     def setUp(self):
-        self.detector = DeepfakeDetector()
+        self.detector.reset()
     
     def test_initialization(self):
         """Test detector initialization"""
@@ -55,11 +98,320 @@ class TestDeepfakeDetection(unittest.TestCase):
         self.assertEqual(self.detector.blink_history, [])
 
 
+class TestFacePreprocessing(unittest.TestCase):
+    """Test shared face preprocessing"""
+    
+    def setUp(self):
+        self.preprocessor = FacePreprocessor()
+        self.frame = np.full((240, 320, 3), 128, dtype=np.uint8)
+    
+    def test_preprocessed_frame_matches_standalone(self):
+        """Test detectors give the same result with and without shared preprocessing"""
+        pre = self.preprocessor.process_frame(self.frame)
+        self.assertEqual(pre.gray.shape, (240, 320))
+        
+        for detector_class in (LivenessDetector, DeepfakeDetector):
+            self.assertEqual(
+                detector_class().process_frame(self.frame, pre),
+                detector_class().process_frame(self.frame)
+            )
+    
+    def test_detectors_use_preprocessed_faces(self):
+        """Test detectors take faces and landmarks from `pre` instead of re-detecting"""
+        rng = np.random.default_rng(0)
+        landmarks = np.column_stack([rng.uniform(0.3, 0.7, (478, 2)), np.zeros(478)]).astype(np.float32)
+        pre = PreprocessedFrame(
+            faces=[(80, 60, 160, 120)],
+            landmarks=landmarks,
+            gray=np.full((240, 320), 128, dtype=np.uint8)
+        )
+        
+        for module, detector_class in ((liveness_detection, LivenessDetector),
+                                       (deepfake_detection, DeepfakeDetector)):
+            with self.subTest(detector=detector_class.__name__):
+                detector = detector_class()
+                # The flat frame has no face, so a result with one can only come from `pre`
+                self.assertFalse(detector.process_frame(self.frame).face_detected)
+                with mock.patch.object(module, 'locate_face', side_effect=AssertionError("re-detected")):
+                    result = detector.process_frame(self.frame, pre)
+                self.assertTrue(result.face_detected)
+        
+        # Landmarks from `pre` drive the landmark checks, not the motion fallback
+        result = LivenessDetector().process_frame(self.frame, pre)
+        self.assertNotEqual(result.detections["head_movement"]["details"], {"reason": "motion_fallback"})
+    
+    @unittest.skipUnless(LANDMARK_PB2_AVAILABLE, "mediapipe not installed")
+    def test_landmarks_from_wire(self):
+        """Test serialized landmarks decode like attribute reads, and other layouts are refused"""
+        coords = np.array([[0.25, 0.5, -0.01], [0.0, 1.0, 0.0], [0.75, 0.125, 0.03]], dtype=np.float32)
+        
+        landmark_list = landmark_pb2.NormalizedLandmarkList()
+        for x, y, z in coords:
+            landmark_list.landmark.add(x=x, y=y, z=z)
+        np.testing.assert_array_equal(_landmarks_from_wire(landmark_list), coords)
+        
+        for extra in ({'visibility': 0.9}, {'presence': 0.9}, {'visibility': 0.9, 'presence': 0.9}):
+            with self.subTest(**extra):
+                landmark_list = landmark_pb2.NormalizedLandmarkList()
+                for x, y, z in coords:
+                    landmark_list.landmark.add(x=x, y=y, z=z, **extra)
+                self.assertIsNone(_landmarks_from_wire(landmark_list))
+
+
+class TestFrameRingBuffer(unittest.TestCase):
+    """Test retained frame storage"""
+    
+    def setUp(self):
+        self.buffer = FrameRingBuffer(2, (640, 480))
+    
+    def tearDown(self):
+        self.buffer.close()
+    
+    def test_frames_are_letterboxed_not_stretched(self):
+        """Test a 16:9 frame keeps its aspect ratio in a 4:3 slot"""
+        frame = np.full((360, 640, 3), 200, dtype=np.uint8)
+        index = self.buffer.write(frame)
+        stored = self.buffer.read(index)
+        
+        self.assertEqual(stored.shape, (480, 640, 3))
+        self.assertTrue((stored[:60] == 0).all())
+        self.assertTrue((stored[60:420] == 200).all())
+        self.assertTrue((stored[420:] == 0).all())
+    
+    def test_overwritten_frames_are_not_readable(self):
+        """Test only the newest `capacity` frames can be read back"""
+        frame = np.zeros((480, 640, 3), dtype=np.uint8)
+        indices = [self.buffer.write(frame) for _ in range(3)]
+        self.assertIsNone(self.buffer.read(indices[0]))
+        self.assertIsNotNone(self.buffer.read(indices[-1]))
+
+
+class TestVideoProcessor(unittest.TestCase):
+    """Test video frame extraction"""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.video_path = os.path.join(cls.tmpdir.name, 'clip.avi')
+        # Each frame's brightness encodes its index (MJPG keeps flat frames exact)
+        writer = cv2.VideoWriter(cls.video_path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48))
+        for index in range(60):
+            writer.write(np.full((48, 64, 3), index * 4, dtype=np.uint8))
+        writer.release()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+    
+    def setUp(self):
+        self.processor = VideoProcessor(target_resolution=(64, 48))
+        # Exercise the OpenCV decoder whatever else is installed
+        for flag in ('PYAV_AVAILABLE', 'CUDACODEC_AVAILABLE'):
+            patcher = mock.patch.object(video_processor, flag, False)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def test_segmented_extraction_matches_serial(self):
+        """Test concurrent segment decoding keeps exactly the frames a serial decode keeps"""
+        for sample_rate in (1, 3, 7):
+            with self.subTest(sample_rate=sample_rate):
+                with mock.patch.object(video_processor, 'EXTRACT_WORKERS', 1):
+                    serial = self.processor.extract_frames(self.video_path, sample_rate)
+                with mock.patch.object(video_processor, 'EXTRACT_WORKERS', 4), \
+                        mock.patch.object(video_processor, 'MIN_SEGMENT_FRAMES', 10), \
+                        mock.patch.object(VideoProcessor, '_extract_frames_segmented', autospec=True,
+                                          side_effect=VideoProcessor._extract_frames_segmented) as segmented:
+                    concurrent = self.processor.extract_frames(self.video_path, sample_rate)
+                
+                segmented.assert_called_once()
+                self.assertIsInstance(serial, np.ndarray)
+                self.assertEqual(serial.shape, (len(range(0, 60, sample_rate)), 48, 64, 3))
+                # Skipped frames are grabbed, not kept
+                np.testing.assert_allclose(serial.mean(axis=(1, 2, 3)), np.arange(0, 60, sample_rate) * 4, atol=1)
+                np.testing.assert_array_equal(concurrent, serial)
+    
+    def test_frame_stack_grows_and_trims(self):
+        """Test the frame stack grows past a short estimate and trims a long one"""
+        shape = (2, 2, 3)
+        short = _FrameStack(2, shape)
+        for index in range(5):
+            short.next_slot()[:] = index
+        frames = short.result()
+        self.assertEqual(len(short.frames), 8)
+        self.assertEqual(frames[:, 0, 0, 0].tolist(), [0, 1, 2, 3, 4])
+        self.assertTrue(np.shares_memory(frames, short.frames))
+        
+        long = _FrameStack(10, shape)
+        long.next_slot()[:] = 7
+        frames = long.result()
+        self.assertEqual(frames.shape, (1,) + shape)
+        self.assertFalse(np.shares_memory(frames, long.frames))
+
+
+class TestFrameDecoder(unittest.TestCase):
+    """Test uploaded frame decoding"""
+    
+    @classmethod
+    def setUpClass(cls):
+        frame = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+        cls.jpeg = cv2.imencode('.jpg', frame)[1].tobytes()
+        cls.png = cv2.imencode('.png', frame)[1].tobytes()
+    
+    def test_jpeg_size(self):
+        """Test the JPEG header is parsed without decoding, and non-JPEGs are rejected"""
+        cases = [
+            (self.jpeg, (640, 480)),
+            (self.jpeg[:200], (640, 480)),
+            (self.png, None),
+            (b'\xff\xd8', None),
+            (b'', None),
+        ]
+        for buf, expected in cases:
+            with self.subTest(length=len(buf)):
+                self.assertEqual(jpeg_size(buf), expected)
+    
+    def test_pick_scaling_factor(self):
+        """Test the strongest downscale that still covers the target is chosen"""
+        cases = [
+            ((640, 480), (160, 120), (1, 4)),
+            ((480, 640), (160, 120), (1, 4)),
+            ((640, 480), (200, 150), (1, 2)),
+            ((640, 480), (640, 480), None),
+            ((640, 480), (1280, 720), None),
+        ]
+        for size, target_size, expected in cases:
+            with self.subTest(size=size, target_size=target_size):
+                self.assertEqual(pick_scaling_factor(size, target_size, OPENCV_REDUCED_FLAGS), expected)
+    
+    @mock.patch.object(frame_decoder, 'TURBOJPEG_AVAILABLE', False)
+    def test_decode_jpeg_reduced_opencv(self):
+        """Test the OpenCV fallback downscales JPEGs while decoding and decodes other formats at full size"""
+        cases = [
+            (self.jpeg, None, (480, 640, 3)),
+            (self.jpeg, (160, 120), (120, 160, 3)),
+            (self.jpeg, (200, 150), (240, 320, 3)),
+            (self.png, (160, 120), (480, 640, 3)),
+        ]
+        for buf, target_size, expected in cases:
+            with self.subTest(target_size=target_size, jpeg=buf is self.jpeg):
+                self.assertEqual(decode_jpeg(buf, target_size=target_size).shape, expected)
+    
+    def test_undecodable_bytes(self):
+        """Test corrupt and truncated frames decode to None"""
+        for buf in (b'', b'not an image', self.jpeg[:600]):
+            with self.subTest(length=len(buf)):
+                self.assertIsNone(decode_jpeg(buf, target_size=(160, 120)))
+
+
+class TestSessionStore(unittest.TestCase):
+    """Test in-memory and Redis session storage"""
+    
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(session_store.time, 'monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = InMemorySessionStore(ttl=60, maxsize=2)
+    
+    def _session(self, session_id):
+        return Session(user_id='user-123', session_id=session_id, created_at='2024-01-01T00:00:00Z')
+    
+    def test_sessions_expire_after_ttl(self):
+        """Test sessions expire ttl seconds after their last write"""
+        self.store.create(self._session('a'))
+        self.now += 50
+        self.assertEqual(self.store.incr('a', 'frame_count'), 1)
+        self.now += 50
+        self.assertIn('a', self.store)
+        
+        self.now += 10
+        self.assertNotIn('a', self.store)
+        self.assertIsNone(self.store.get('a'))
+        self.assertIsNone(self.store.incr('a', 'frame_count'))
+    
+    def test_least_recently_written_session_is_evicted(self):
+        """Test the store drops the least recently written session once full"""
+        for session_id in ('a', 'b'):
+            self.store.create(self._session(session_id))
+            self.now += 1
+        self.store.update('a', {'status': 'completed'})
+        self.store.create(self._session('c'))
+        
+        self.assertNotIn('b', self.store)
+        self.assertIn('a', self.store)
+        self.assertIn('c', self.store)
+    
+    def test_purge_expired(self):
+        """Test purge_expired removes only expired sessions"""
+        self.store.create(self._session('a'))
+        self.now += 30
+        self.store.create(self._session('b'))
+        self.now += 40
+        
+        self.assertEqual(self.store.purge_expired(), 1)
+        self.assertEqual(self.store.purge_expired(), 0)
+        self.assertIn('b', self.store)
+    
+    def test_record_analysis(self):
+        """Test record_analysis applies fields and increments in one step"""
+        self.store.create(self._session('a'))
+        for score in (0.25, 0.75):
+            self.store.record_analysis(
+                'a',
+                entry={'frame_id': 1},
+                fields={'last_analysis': {'liveness_score': score}},
+                increments={'liveness_sum': score, 'liveness_frames': 1}
+            )
+        
+        session = self.store.get('a')
+        self.assertEqual(session.frames_processed, 2)
+        self.assertEqual(session.liveness_frames, 2)
+        self.assertAlmostEqual(session.liveness_sum, 1.0)
+        self.assertEqual(session.last_analysis, {'liveness_score': 0.75})
+        self.assertEqual(len(self.store._frames['a']), 2)
+    
+    @unittest.skipUnless(REDIS_AVAILABLE, "redis/msgpack not installed")
+    def test_unreachable_redis_falls_back_to_memory(self):
+        """Test an unreachable REDIS_URL falls back to in-memory sessions"""
+        store = create_session_store('redis://127.0.0.1:1/0')
+        self.assertIsInstance(store, InMemorySessionStore)
+    
+    @unittest.skipUnless(REDIS_AVAILABLE and FAKEREDIS_AVAILABLE, "redis/msgpack/fakeredis not installed")
+    def test_redis_round_trip(self):
+        """Test sessions survive the msgpack round trip through Redis"""
+        with mock.patch.object(session_store.redis.Redis, 'from_url', return_value=fakeredis.FakeRedis()):
+            store = RedisSessionStore('redis://localhost:6379/0')
+        store.create(self._session('a'))
+        store.update('a', {'current_challenge': {'type': 'blink', 'timeout': np.float32(5.0)}})
+        self.assertEqual(store.incr('a', 'frame_count'), 1)
+        store.record_analysis(
+            'a',
+            entry={'frame_id': 1, 'liveness': LivenessAnalysis(face_detected=True, liveness_score=0.5)},
+            fields={'last_analysis': {'liveness_score': np.float64(0.5)}},
+            increments={'liveness_sum': 0.5, 'liveness_frames': 1}
+        )
+        
+        session = store.get('a')
+        self.assertEqual(session.user_id, 'user-123')
+        self.assertEqual(session.current_challenge, {'type': 'blink', 'timeout': 5.0})
+        self.assertEqual(session.last_analysis, {'liveness_score': 0.5})
+        self.assertEqual(session.frame_count, 1)
+        self.assertEqual(session.frames_processed, 1)
+        self.assertEqual(session.liveness_frames, 1)
+        self.assertAlmostEqual(session.liveness_sum, 0.5)
+        self.assertIsNone(store.incr('missing', 'frame_count'))
+        self.assertIsNone(store.get('missing'))
+
+
 class TestSpoofAlerting(unittest.TestCase):
     """Test spoof alerting functionality"""
     
+    @classmethod
+    def setUpClass(cls):
+        cls.alerter = SpoofAlertingService()
+    
     def setUp(self):
-        self.alerter = SpoofAlertingService()
+        self.alerter.reset()
     
     def test_alert_creation(self):
         """Test alert creation"""
@@ -78,19 +430,20 @@ class TestSpoofAlerting(unittest.TestCase):
     
     def test_alert_severity_determination(self):
         """Test alert severity determination"""
-        severity = self.alerter.determine_alert_severity(
-            deepfake_score=0.85,
-            liveness_score=0.1,
-            indicators={}
-        )
-        self.assertEqual(severity, AlertSeverity.CRITICAL)
-        
-        severity = self.alerter.determine_alert_severity(
-            deepfake_score=0.4,
-            liveness_score=0.8,
-            indicators={}
-        )
-        self.assertEqual(severity, AlertSeverity.LOW)
+        cases = [
+            (0.85, 0.1, AlertSeverity.CRITICAL),
+            (0.75, 0.8, AlertSeverity.HIGH),
+            (0.6, 0.8, AlertSeverity.MEDIUM),
+            (0.4, 0.8, AlertSeverity.LOW),
+        ]
+        for deepfake_score, liveness_score, expected in cases:
+            with self.subTest(deepfake_score=deepfake_score, liveness_score=liveness_score):
+                severity = self.alerter.determine_alert_severity(
+                    deepfake_score=deepfake_score,
+                    liveness_score=liveness_score,
+                    indicators={}
+                )
+                self.assertEqual(severity, expected)
     
     def test_alert_acknowledgment(self):
         """Test alert acknowledgment"""
@@ -125,6 +478,36 @@ class TestSpoofAlerting(unittest.TestCase):
         active_alerts = self.alerter.get_active_alerts()
         self.assertEqual(len(active_alerts), initial_count + 1)
     
+    def test_duplicate_alert_suppressed(self):
+        """Test repeated alerts for a session are collapsed within the window"""
+        first = self.alerter.create_alert(
+            alert_type=AlertType.FACE_NOT_DETECTED,
+            session_id='test-dup',
+            severity=AlertSeverity.MEDIUM,
+            message='Face not detected',
+            details={}
+        )
+        repeat = self.alerter.create_alert(
+            alert_type=AlertType.FACE_NOT_DETECTED,
+            session_id='test-dup',
+            severity=AlertSeverity.MEDIUM,
+            message='Face not detected',
+            details={}
+        )
+        self.assertIs(repeat, first)
+        self.assertEqual(len(self.alerter.alerts), 1)
+        
+        # A more severe repeat is still raised
+        escalated = self.alerter.create_alert(
+            alert_type=AlertType.FACE_NOT_DETECTED,
+            session_id='test-dup',
+            severity=AlertSeverity.HIGH,
+            message='Face not detected',
+            details={}
+        )
+        self.assertIsNot(escalated, first)
+        self.assertEqual(len(self.alerter.alerts), 2)
+    
     def test_alert_statistics(self):
         """Test alert statistics"""
         stats = self.alerter.get_alert_statistics()
@@ -133,62 +516,218 @@ class TestSpoofAlerting(unittest.TestCase):
         self.assertIn('active_alerts', stats)
         self.assertIn('by_severity', stats)
         self.assertIn('by_type', stats)
+    
+    def test_alerts_are_batched_into_digests(self):
+        """Test alerts raised within the digest interval go out as one message per channel"""
+        alerter = SpoofAlertingService(digest_interval=0.2)
+        with mock.patch.object(alerter, '_send_email_alert') as send_email, \
+                mock.patch.object(alerter, '_send_slack_alert') as send_slack:
+            created = [
+                alerter.create_alert(
+                    alert_type=AlertType.DEEPFAKE_DETECTED,
+                    session_id=f'test-digest-{i}',
+                    severity=AlertSeverity.HIGH,
+                    message='Deepfake detected',
+                    details={}
+                )
+                for i in range(3)
+            ]
+            deadline = time.monotonic() + 5
+            while not (send_email.called and send_slack.called) and time.monotonic() < deadline:
+                time.sleep(0.05)
+        
+        send_email.assert_called_once_with(created, ['fraud-team@institution.com', 'operations@institution.com'])
+        send_slack.assert_called_once_with(created)
+    
+    def test_alert_history_is_bounded(self):
+        """Test old alerts leave the history but still count in the statistics"""
+        alerter = SpoofAlertingService(max_history=2)
+        created = [
+            alerter.create_alert(
+                alert_type=AlertType.DEEPFAKE_DETECTED,
+                session_id=f'test-bounded-{i}',
+                severity=AlertSeverity.HIGH,
+                message='Deepfake detected',
+                details={}
+            )
+            for i in range(3)
+        ]
+        
+        self.assertEqual(list(alerter.alerts), created[1:])
+        self.assertFalse(alerter.acknowledge_alert(created[0].alert_id, 'operator-1'))
+        self.assertEqual(len(alerter.get_active_alerts()), 2)
+        
+        stats = alerter.get_alert_statistics()
+        self.assertEqual(stats['total_alerts'], 3)
+        self.assertEqual(stats['active_alerts'], 2)
 
 
 class TestVerificationFlow(unittest.TestCase):
     """Test end-to-end verification flow"""
     
+    @classmethod
+    def setUpClass(cls):
+        cls.liveness_detector = LivenessDetector()
+        cls.deepfake_detector = DeepfakeDetector()
+        cls.alerter = SpoofAlertingService()
+    
     def setUp(self):
-        self.liveness_detector = LivenessDetector()
-        self.deepfake_detector = DeepfakeDetector()
-        self.alerter = SpoofAlertingService()
+        self.alerter.reset()
     
     def test_verification_result_evaluation(self):
-        """Test verification result evaluation"""
-        deepfake_analysis = {
-            'deepfake_score': 0.85,
-            'face_detected': True,
-            'indicators': {}
-        }
-        
-        liveness_analysis = {
-            'liveness_score': 0.1,
-            'face_detected': True
-        }
-        
-        result = self.alerter.evaluate_verification_result(
-            session_id='test-session',
-            user_id='user-123',
-            deepfake_analysis=deepfake_analysis,
-            liveness_analysis=liveness_analysis
+        """Test verification result evaluation for failing and passing sessions"""
+        cases = [
+            (0.85, 0.1, False, 'FAILED'),
+            (0.2, 0.9, True, 'PASSED'),
+        ]
+        for deepfake_score, liveness_score, expected_verified, expected_status in cases:
+            with self.subTest(deepfake_score=deepfake_score, liveness_score=liveness_score):
+                self.alerter.reset()
+                deepfake_analysis = {
+                    'deepfake_score': deepfake_score,
+                    'face_detected': True,
+                    'indicators': {}
+                }
+                
+                liveness_analysis = {
+                    'liveness_score': liveness_score,
+                    'face_detected': True
+                }
+                
+                result = self.alerter.evaluate_verification_result(
+                    session_id='test-session',
+                    user_id='user-123',
+                    deepfake_analysis=deepfake_analysis,
+                    liveness_analysis=liveness_analysis
+                )
+                
+                self.assertEqual(result['verified'], expected_verified)
+                self.assertEqual(result['status'], expected_status)
+                self.assertEqual(len(result['alerts']) > 0, not expected_verified)
+
+
+class TestApi(unittest.TestCase):
+    """Test HTTP API behaviour"""
+    
+    @classmethod
+    def setUpClass(cls):
+        from app import app as app_module
+        cls.app_module = app_module
+        cls.client = app_module.app.test_client()
+        cls.jpeg = cv2.imencode('.jpg', np.zeros((48, 64, 3), dtype=np.uint8))[1].tobytes()
+    
+    def setUp(self):
+        # Don't let frames queued by an earlier test reach this one's mocks
+        self.app_module.frame_queue.join()
+    
+    def test_frame_upload_preflight_allows_metadata_headers(self):
+        """Test CORS preflight allows the headers the frontend sends with raw frames"""
+        response = self.client.options(
+            '/api/v1/kyc/upload-video-frame',
+            headers={
+                'Origin': 'http://localhost:3000',
+                'Access-Control-Request-Method': 'POST',
+                'Access-Control-Request-Headers': 'content-type,x-session-id,x-frame-ts'
+            }
         )
-        
-        self.assertFalse(result['verified'])
-        self.assertEqual(result['status'], 'FAILED')
-        self.assertGreater(len(result['alerts']), 0)
+        allowed = {h.strip().lower() for h in response.headers.get('Access-Control-Allow-Headers', '').split(',')}
+        self.assertTrue({'content-type', 'x-session-id', 'x-frame-ts'} <= allowed)
+    
+    def _start_session(self):
+        response = self.client.post('/api/v1/kyc/start-session', json={'user_id': 'user-123'})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['session_id']
+    
+    def _upload(self, session_id, jpeg, encoding):
+        if encoding == 'octet-stream':
+            return self.client.post(
+                '/api/v1/kyc/upload-video-frame',
+                data=jpeg,
+                content_type='application/octet-stream',
+                headers={'X-Session-Id': session_id, 'X-Frame-Ts': '1234.5'}
+            )
+        if encoding == 'multipart':
+            return self.client.post(
+                '/api/v1/kyc/upload-video-frame',
+                data={'session_id': session_id, 'frame': (io.BytesIO(jpeg), 'frame.jpg')},
+                content_type='multipart/form-data'
+            )
+        data_url = 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode()
+        return self.client.post(
+            '/api/v1/kyc/upload-video-frame',
+            json={'session_id': session_id, 'frame': data_url}
+        )
+    
+    def test_frame_upload_encodings(self):
+        """Test raw, multipart and legacy data URL uploads are accepted, and bad bytes rejected"""
+        jpeg = self.jpeg
+        for encoding in ('octet-stream', 'multipart', 'data-url'):
+            with self.subTest(encoding=encoding):
+                session_id = self._start_session()
+                
+                response = self._upload(session_id, jpeg, encoding)
+                self.assertEqual(response.status_code, 200)
+                body = response.get_json()
+                self.assertEqual(body['session_id'], session_id)
+                self.assertTrue(body['frame_received'])
+                if encoding == 'octet-stream':
+                    self.assertEqual(body['frame_ts'], '1234.5')
+                
+                response = self._upload(session_id, b'not an image', encoding)
+                self.assertEqual(response.status_code, 400)
+                
+                response = self._upload('no-such-session', jpeg, encoding)
+                self.assertEqual(response.status_code, 400)
     
-    def test_successful_verification(self):
-        """Test successful verification"""
-        deepfake_analysis = {
-            'deepfake_score': 0.2,
-            'face_detected': True,
-            'indicators': {}
-        }
+    def test_completion_waits_for_queued_frames(self):
+        """Test completion waits for every queued frame and aggregates all of them"""
+        scores = iter([0.6, 0.8, 1.0])
         
-        liveness_analysis = {
-            'liveness_score': 0.9,
-            'face_detected': True
-        }
+        def slow_analyze(frames):
+            time.sleep(0.05)
+            return [
+                (LivenessAnalysis(face_detected=True, liveness_score=score),
+                 DeepfakeAnalysis(face_detected=True, deepfake_score=1.0 - score))
+                for score in (next(scores) for _ in frames)
+            ]
         
-        result = self.alerter.evaluate_verification_result(
-            session_id='test-session',
-            user_id='user-123',
-            deepfake_analysis=deepfake_analysis,
-            liveness_analysis=liveness_analysis
-        )
+        session_id = self._start_session()
+        with mock.patch.object(self.app_module, 'analyze_frames', side_effect=slow_analyze):
+            for _ in range(3):
+                self.assertEqual(self._upload(session_id, self.jpeg, 'octet-stream').status_code, 200)
+            response = self.client.post('/api/v1/kyc/complete-verification', json={'session_id': session_id})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()['verified'])
+        session = self.app_module.session_store.get(session_id)
+        self.assertEqual(session.frames_processed, 3)
+        self.assertAlmostEqual(session.liveness_sum / session.liveness_frames, 0.8)
+        self.assertAlmostEqual(session.deepfake_sum / session.deepfake_frames, 0.2)
+    
+    def test_full_queue_rejects_frame(self):
+        """Test a frame that cannot be queued gets a 503 and leaves no trace on the session"""
+        session_id = self._start_session()
+        full_queue = queue.Queue(maxsize=1)
+        full_queue.put(None)
+        
+        with mock.patch.object(self.app_module, 'frame_queue', full_queue), \
+                mock.patch.object(Config, 'ANALYSIS_QUEUE_TIMEOUT', 0.01):
+            response = self._upload(session_id, self.jpeg, 'octet-stream')
         
-        self.assertTrue(result['verified'])
-        self.assertEqual(result['status'], 'PASSED')
+        self.assertEqual(response.status_code, 503)
+        self.assertNotIn(session_id, self.app_module.pending_frames)
+        self.assertEqual(self.app_module.session_store.get(session_id).frame_count, 0)
+    
+    def test_analysis_stride(self):
+        """Test only every ANALYSIS_STRIDE-th frame is queued for analysis"""
+        session_id = self._start_session()
+        with mock.patch.object(Config, 'ANALYSIS_STRIDE', 3):
+            queued = [
+                self._upload(session_id, self.jpeg, 'octet-stream').get_json()['queued']
+                for _ in range(5)
+            ]
+        self.assertEqual(queued, [True, False, False, True, False])
+        self.assertEqual(self.app_module.session_store.get(session_id).frame_count, 5)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,13 @@
+"""
+KYC Verification System - WSGI Entry Point
+Production servers import `app` from here, e.g.:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import sys
+from pathlib import Path
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+
+from app.app import app